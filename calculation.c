@@ -1,157 +1,509 @@
-#include <stdio.h>
+#include <errno.h>
+#include <math.h>
+#include <stdlib.h>
 #include <string.h>
 
-#define maxn 100005
-
-char s[maxn],infixList[maxn][10];
-char suffix[maxn][10];
-int p=0;
-char tmp[maxn];
-int p1=0;
-
-//把字符串根据操作数、运算符、括号拆开，存储到infixList数组中
-int _toInfixExpression(char *s) {
-    int tot=0,n=strlen(s);
-    for(int i=0;i<n;i++) {
-        if(s[i]>='0'&&s[i]<='9') {
-            int p=0;
-            infixList[tot][p++]=s[i];
-            while(i+1<n&&s[i+1]>='0'&&s[i+1]<='9') {
-                infixList[tot][p++]=s[++i];
+#ifdef _WIN32
+#define GRAPHICAL_API __declspec(dllexport)
+#else
+#define GRAPHICAL_API __attribute__((visibility("default")))
+#endif
+
+//计算结果的状态，不是 GRAPHICAL_OK 时由 Python 的 eval 重新计算
+#define GRAPHICAL_OK 0
+#define GRAPHICAL_SYNTAX 1    //不支持的语法
+#define GRAPHICAL_ZERO_DIVISION 2    //除数为零
+#define GRAPHICAL_OVERFLOW 3    //超出了 int64 或 double 能精确表示的范围
+#define GRAPHICAL_DOMAIN 4    //结果是复数等
+#define GRAPHICAL_MEMORY 5    //内存不足
+
+//数值的类型
+#define GRAPHICAL_INT 0
+#define GRAPHICAL_FLOAT 1
+
+#define MAX_NESTING 200    //括号等最多嵌套的层数，和 Python 的解析器差不多
+#define EXACT_LIMIT 9007199254740992LL    //2**53，再大的整数转成 double 会丢失精度
+
+//带类型的数值
+typedef struct {
+    int type;
+    long long i;
+    double d;
+} graphical_value;
+
+//指令
+enum {
+    OP_INT,    //压入整数
+    OP_FLOAT,    //压入浮点数
+    OP_VAR,    //压入变量，value.i 是变量的序号，只在批量计算时使用
+    OP_ADD,
+    OP_SUB,
+    OP_MUL,
+    OP_DIV,
+    OP_POW,
+    OP_NEG
+};
+
+typedef struct {
+    int op;
+    graphical_value value;    //OP_INT 和 OP_FLOAT 的操作数
+} instruction;
+
+//编译好的表达式，是一串后缀表达式形式的指令
+typedef struct {
+    instruction *code;
+    int size;
+    int capacity;
+    int depth;    //当前栈的深度
+    int max_depth;    //计算时最多需要的栈空间
+} program;
+
+//解析器，每次调用都有自己的一份，所以是可重入的
+typedef struct {
+    const char *s;
+    int pos;
+    int nesting;
+    int status;
+    program *prog;
+    const char *const *names;    //变量名，没有变量时为 NULL
+    int nnames;
+} parser;
+
+static int _emit(parser *ps,int op,graphical_value value) {
+    program *prog=ps->prog;
+    if(prog->size==prog->capacity) {
+        int capacity=prog->capacity?prog->capacity*2:16;
+        instruction *code=realloc(prog->code,capacity*sizeof(instruction));
+        if(!code) {
+            ps->status=GRAPHICAL_MEMORY;
+            return 0;
+        }
+        prog->code=code;
+        prog->capacity=capacity;
+    }
+    prog->code[prog->size].op=op;
+    prog->code[prog->size].value=value;
+    prog->size++;
+    //记录栈的深度，数值入栈，二元运算出栈两个入栈一个
+    if(op==OP_INT||op==OP_FLOAT||op==OP_VAR) prog->depth++;
+    else if(op!=OP_NEG) prog->depth--;
+    if(prog->depth>prog->max_depth) prog->max_depth=prog->depth;
+    return 1;
+}
+
+static int _emit_op(parser *ps,int op) {
+    graphical_value none={GRAPHICAL_INT,0,0.0};
+    return _emit(ps,op,none);
+}
+
+static void _skip_space(parser *ps) {
+    while(ps->s[ps->pos]==' '||ps->s[ps->pos]=='\t') ps->pos++;
+}
+
+static int _is_digit(char c) {
+    return c>='0'&&c<='9';
+}
+
+//解析数字，整数和浮点数(小数、科学计数法)
+static int _parse_number(parser *ps) {
+    const char *start=ps->s+ps->pos;
+    const char *p=start;
+    int is_float=0;
+    while(_is_digit(*p)) p++;
+    if(*p=='.') {
+        is_float=1;
+        p++;
+        while(_is_digit(*p)) p++;
+    }
+    if(p==start||(p==start+1&&*start=='.')) {
+        ps->status=GRAPHICAL_SYNTAX;
+        return 0;
+    }
+    if(*p=='e'||*p=='E') {
+        const char *q=p+1;
+        if(*q=='+'||*q=='-') q++;
+        if(!_is_digit(*q)) {
+            ps->status=GRAPHICAL_SYNTAX;
+            return 0;
+        }
+        while(_is_digit(*q)) q++;
+        p=q;
+        is_float=1;
+    }
+    //像 1_000、0x10、1j 这样的写法交给 Python
+    if(*p=='_'||*p=='j'||*p=='J'||(*p>='a'&&*p<='z')||(*p>='A'&&*p<='Z')) {
+        ps->status=GRAPHICAL_SYNTAX;
+        return 0;
+    }
+    graphical_value value={GRAPHICAL_INT,0,0.0};
+    if(is_float) {
+        value.type=GRAPHICAL_FLOAT;
+        value.d=strtod(start,NULL);
+    }else{
+        for(const char *q=start;q<p;q++) {
+            if(__builtin_mul_overflow(value.i,10LL,&value.i)||
+               __builtin_add_overflow(value.i,(long long)(*q-'0'),&value.i)) {
+                ps->status=GRAPHICAL_OVERFLOW;    //大整数交给 Python
+                return 0;
             }
-            tot++;
+        }
+    }
+    ps->pos+=(int)(p-start);
+    return _emit(ps,is_float?OP_FLOAT:OP_INT,value);
+}
+
+static int _is_name_char(char c) {
+    return c=='_'||(c>='a'&&c<='z')||(c>='A'&&c<='Z')||_is_digit(c);
+}
+
+//解析变量名，在变量名列表里找到对应的序号
+static int _parse_name(parser *ps) {
+    const char *start=ps->s+ps->pos;
+    int length=0;
+    while(_is_name_char(start[length])) length++;
+    for(int k=0;k<ps->nnames;k++) {
+        if((int)strlen(ps->names[k])==length&&strncmp(ps->names[k],start,length)==0) {
+            graphical_value value={GRAPHICAL_INT,k,0.0};
+            ps->pos+=length;
+            return _emit(ps,OP_VAR,value);
+        }
+    }
+    ps->status=GRAPHICAL_SYNTAX;    //不认识的变量或者函数
+    return 0;
+}
+
+static int _parse_expression(parser *ps);
+static int _parse_unary(parser *ps);
+
+//atom := number | name | '(' expression ')'
+static int _parse_atom(parser *ps) {
+    _skip_space(ps);
+    char c=ps->s[ps->pos];
+    if(c=='(') {
+        ps->pos++;
+        if(!_parse_expression(ps)) return 0;
+        _skip_space(ps);
+        if(ps->s[ps->pos]!=')') {
+            ps->status=GRAPHICAL_SYNTAX;
+            return 0;
+        }
+        ps->pos++;
+        return 1;
+    }
+    if(_is_digit(c)||c=='.') return _parse_number(ps);
+    if(c=='_'||(c>='a'&&c<='z')||(c>='A'&&c<='Z')) return _parse_name(ps);
+    ps->status=GRAPHICAL_SYNTAX;
+    return 0;
+}
+
+//power := atom ['**' unary]，和 Python 一样是右结合的，-2**2 == -4
+static int _parse_power(parser *ps) {
+    if(!_parse_atom(ps)) return 0;
+    _skip_space(ps);
+    if(ps->s[ps->pos]=='*'&&ps->s[ps->pos+1]=='*') {
+        ps->pos+=2;
+        if(!_parse_unary(ps)) return 0;
+        return _emit_op(ps,OP_POW);
+    }
+    return 1;
+}
+
+//unary := ('-'|'+') unary | power
+static int _parse_unary(parser *ps) {
+    _skip_space(ps);
+    char c=ps->s[ps->pos];
+    if(c=='-'||c=='+') {
+        if(++ps->nesting>MAX_NESTING) {
+            ps->status=GRAPHICAL_SYNTAX;
+            return 0;
+        }
+        ps->pos++;
+        if(!_parse_unary(ps)) return 0;
+        ps->nesting--;
+        return c=='-'?_emit_op(ps,OP_NEG):1;
+    }
+    return _parse_power(ps);
+}
+
+//term := unary (('*'|'/') unary)*
+static int _parse_term(parser *ps) {
+    if(!_parse_unary(ps)) return 0;
+    while(1) {
+        _skip_space(ps);
+        char c=ps->s[ps->pos];
+        if(c=='*'&&ps->s[ps->pos+1]!='*') {
+            ps->pos++;
+            if(!_parse_unary(ps)||!_emit_op(ps,OP_MUL)) return 0;
+        }else if(c=='/'&&ps->s[ps->pos+1]!='/') {
+            ps->pos++;
+            if(!_parse_unary(ps)||!_emit_op(ps,OP_DIV)) return 0;
+        }else{
+            return 1;
+        }
+    }
+}
+
+//expression := term (('+'|'-') term)*
+static int _parse_expression(parser *ps) {
+    if(++ps->nesting>MAX_NESTING) {
+        ps->status=GRAPHICAL_SYNTAX;
+        return 0;
+    }
+    if(!_parse_term(ps)) return 0;
+    while(1) {
+        _skip_space(ps);
+        char c=ps->s[ps->pos];
+        if(c=='+'||c=='-') {
+            ps->pos++;
+            if(!_parse_term(ps)||!_emit_op(ps,c=='+'?OP_ADD:OP_SUB)) return 0;
         }else{
-            infixList[tot++][0]=s[i];
+            break;
         }
     }
-    return tot;
+    ps->nesting--;
+    return 1;
+}
+
+//编译表达式，失败时返回状态码
+static int _compile(const char *s,const char *const *names,int nnames,program *prog) {
+    parser ps={s,0,0,GRAPHICAL_OK,prog,names,nnames};
+    memset(prog,0,sizeof(program));
+    if(_parse_expression(&ps)) {
+        _skip_space(&ps);
+        if(ps.s[ps.pos]!='\0') ps.status=GRAPHICAL_SYNTAX;    //后面还有不认识的内容
+    }else if(ps.status==GRAPHICAL_OK) {
+        ps.status=GRAPHICAL_SYNTAX;
+    }
+    return ps.status;
 }
 
-//获得优先级
-int _getPriority(char c) {
-    if(c=='+'||c=='-') return 1;
-    else if(c=='*'||c=='/') return 2;
-    else return 0; //处理'('的情况
+static double _to_double(const graphical_value *v) {
+    return v->type==GRAPHICAL_INT?(double)v->i:v->d;
 }
 
-//转换成后缀表达式
-void _parseSuffixExpression(char s[][10],int n) {
+//整数转浮点数会不会丢失精度，丢失的话 Python 的结果可能不一样
+static int _exact(const graphical_value *v) {
+    return v->type==GRAPHICAL_FLOAT||(v->i<=EXACT_LIMIT&&v->i>=-EXACT_LIMIT);
+}
+
+//整数的乘方，exponent 不能是负数
+static int _int_pow(long long base,long long exponent,long long *out) {
+    long long result=1;
+    while(exponent>0) {
+        if(exponent&1) {
+            if(__builtin_mul_overflow(result,base,&result)) return GRAPHICAL_OVERFLOW;
+        }
+        exponent>>=1;
+        if(exponent>0&&__builtin_mul_overflow(base,base,&base)) return GRAPHICAL_OVERFLOW;
+    }
+    *out=result;
+    return GRAPHICAL_OK;
+}
+
+//浮点数的乘方，按 Python 的规则处理特殊情况
+static int _float_pow(double a,double b,double *out) {
+    if(a==0.0&&b<0.0) return GRAPHICAL_ZERO_DIVISION;
+    if(a<0.0&&b!=floor(b)&&isfinite(b)) return GRAPHICAL_DOMAIN;    //Python 会返回复数
+    errno=0;
+    double r=pow(a,b);
+    if(isinf(r)&&isfinite(a)&&isfinite(b)) return GRAPHICAL_OVERFLOW;
+    *out=r;
+    return GRAPHICAL_OK;
+}
+
+//执行一条二元运算指令，结果写回 a
+static int _binary(int op,graphical_value *a,const graphical_value *b) {
+    if(a->type==GRAPHICAL_INT&&b->type==GRAPHICAL_INT) {
+        long long r;
+        switch(op) {
+        case OP_ADD:
+            if(__builtin_add_overflow(a->i,b->i,&r)) return GRAPHICAL_OVERFLOW;
+            a->i=r;
+            return GRAPHICAL_OK;
+        case OP_SUB:
+            if(__builtin_sub_overflow(a->i,b->i,&r)) return GRAPHICAL_OVERFLOW;
+            a->i=r;
+            return GRAPHICAL_OK;
+        case OP_MUL:
+            if(__builtin_mul_overflow(a->i,b->i,&r)) return GRAPHICAL_OVERFLOW;
+            a->i=r;
+            return GRAPHICAL_OK;
+        case OP_POW:
+            if(b->i>=0) return _int_pow(a->i,b->i,&a->i);
+            if(a->i==0) return GRAPHICAL_ZERO_DIVISION;
+            break;    //负数次方的结果是浮点数
+        }
+    }
+    if(!_exact(a)||!_exact(b)) return GRAPHICAL_OVERFLOW;
+    double x=_to_double(a),y=_to_double(b);
+    a->type=GRAPHICAL_FLOAT;
+    switch(op) {
+    case OP_ADD:
+        a->d=x+y;
+        return GRAPHICAL_OK;
+    case OP_SUB:
+        a->d=x-y;
+        return GRAPHICAL_OK;
+    case OP_MUL:
+        a->d=x*y;
+        return GRAPHICAL_OK;
+    case OP_DIV:
+        if(y==0.0) return GRAPHICAL_ZERO_DIVISION;
+        a->d=x/y;
+        return GRAPHICAL_OK;
+    case OP_POW:
+        return _float_pow(x,y,&a->d);
+    }
+    return GRAPHICAL_SYNTAX;
+}
 
-    for(int i=0;i<n;i++) {
-        if(s[i][0]>='0'&&s[i][0]<='9') {
-            strcpy(suffix[p++],s[i]);
-        }else if(s[i][0]=='('){
-            tmp[p1++]=s[i][0];
-        }else if(s[i][0]==')') {
-            while(tmp[p1-1]!='(') {
-                suffix[p++][0]=tmp[--p1];
+//在数值栈上执行编译好的表达式
+static int _execute(const program *prog,graphical_value *stack,graphical_value *out) {
+    int top=0;
+    for(int k=0;k<prog->size;k++) {
+        const instruction *ins=&prog->code[k];
+        switch(ins->op) {
+        case OP_INT:
+        case OP_FLOAT:
+            stack[top++]=ins->value;
+            break;
+        case OP_NEG:
+            if(stack[top-1].type==GRAPHICAL_INT) {
+                if(stack[top-1].i==(-9223372036854775807LL-1)) return GRAPHICAL_OVERFLOW;
+                stack[top-1].i=-stack[top-1].i;
+            }else{
+                stack[top-1].d=-stack[top-1].d;
             }
-            p1--;
+            break;
+        default: {
+            int status=_binary(ins->op,&stack[top-2],&stack[top-1]);
+            if(status!=GRAPHICAL_OK) return status;
+            top--;
+        }
+        }
+    }
+    *out=stack[0];
+    return GRAPHICAL_OK;
+}
+
+//计算表达式，结果写入 out，返回状态码
+GRAPHICAL_API int graphical_compute(const char *expression,graphical_value *out) {
+    program prog;
+    int status=_compile(expression,NULL,0,&prog);
+    if(status==GRAPHICAL_OK) {
+        graphical_value small[32];
+        graphical_value *stack=small;
+        if(prog.max_depth>32) stack=malloc(prog.max_depth*sizeof(graphical_value));
+        if(stack) {
+            status=_execute(&prog,stack,out);
+            if(stack!=small) free(stack);
         }else{
-            while(p1!=0 && _getPriority(tmp[p1-1])>=_getPriority(s[i][0])){
-                suffix[p++][0]=tmp[--p1];
-            }
-            tmp[p1++]=s[i][0];
+            status=GRAPHICAL_MEMORY;
         }
-     }
-     while(p1!=0) {
-         suffix[p++][0]=tmp[--p1];
-     }
-}
-
-//计算一个以字符串形式存储的数的值
-int _parseInt(char *s) {
-    int k=strlen(s);
-    int ans=0;
-    for(int i=0;i<k;i++) {
-        ans=ans*10+(s[i]-'0');
-    }
-    return ans;
-}
-
-//将数k转化成字符串形式存储到指针s开始的地方
-void _parseString(char *s,int k){
-    char b[11];
-    int point=0;
-    do{
-        b[point++]=(char)('0'+k%10);
-        k/=10;
-    }while(k!=0);
-    for(int i=point-1,j=0;i>=0;i--,j++) {
-        *(s+j)=b[i];
-    }
-    *(s+point)='\0';
-}
-
-//计算后缀表达式的值
-int _calculate() {
-    int point=0;
-    char t[maxn][10];
-    int m=1;
-    for(int i=0;i<p;i++) {
-        int k=strlen(suffix[i]);
-        if(suffix[i][0]>='0'&&suffix[i][0]<='9') {
-            strcpy(t[point++],suffix[i]);
-            t[point-1][k]='\0';
-        }else {
-            int b=_parseInt(t[--point]);
-            int a=_parseInt(t[--point]);
-            int res=0;
-            if(suffix[i][0]=='+') {
-                res=a+b;
-                //printf("(%d) %d + %d = %d\n",m++,a,b,res);
-            }else if(suffix[i][0]=='-') {
-                res=a-b;
-                //printf("(%d) %d - %d = %d\n",m++,a,b,res);
-            }else if(suffix[i][0]=='*') {
-                res=a*b;
-                //printf("(%d) %d * %d = %d\n",m++,a,b,res);
-            }else if(suffix[i][0]=='/') {
-                if(b==0) {
-                    //printf("除数为零出错！！！\n");
-                    return -1;
-                }
-                res=a/b;
-                //printf("(%d) %d / %d = %d\n",m++,a,b,res);
+    }
+    free(prog.code);
+    return status;
+}
+
+//编译一个带变量的表达式，用于批量计算
+//names 是变量名，表达式里的变量在计算时对应同样序号的那一列
+//失败时返回 NULL，状态码写入 status
+GRAPHICAL_API program *graphical_compile(const char *expression,const char *const *names,int nnames,int *status) {
+    program *prog=malloc(sizeof(program));
+    if(!prog) {
+        *status=GRAPHICAL_MEMORY;
+        return NULL;
+    }
+    *status=_compile(expression,names,nnames,prog);
+    if(*status!=GRAPHICAL_OK) {
+        free(prog->code);
+        free(prog);
+        return NULL;
+    }
+    return prog;
+}
+
+//释放编译好的表达式
+GRAPHICAL_API void graphical_free(program *prog) {
+    if(prog) {
+        free(prog->code);
+        free(prog);
+    }
+}
+
+//在 double 栈上计算一行
+static int _execute_double(const program *prog,const double *const *columns,long long row,double *stack,double *out) {
+    int top=0;
+    for(int k=0;k<prog->size;k++) {
+        const instruction *ins=&prog->code[k];
+        double a,b;
+        switch(ins->op) {
+        case OP_INT:
+            stack[top++]=(double)ins->value.i;
+            break;
+        case OP_FLOAT:
+            stack[top++]=ins->value.d;
+            break;
+        case OP_VAR:
+            stack[top++]=columns[ins->value.i][row];
+            break;
+        case OP_NEG:
+            stack[top-1]=-stack[top-1];
+            break;
+        default:
+            b=stack[--top];
+            a=stack[top-1];
+            switch(ins->op) {
+            case OP_ADD:
+                stack[top-1]=a+b;
+                break;
+            case OP_SUB:
+                stack[top-1]=a-b;
+                break;
+            case OP_MUL:
+                stack[top-1]=a*b;
+                break;
+            case OP_DIV:
+                if(b==0.0) return GRAPHICAL_ZERO_DIVISION;
+                stack[top-1]=a/b;
+                break;
+            case OP_POW: {
+                int status=_float_pow(a,b,&stack[top-1]);
+                if(status!=GRAPHICAL_OK) return status;
+                break;
+            }
             }
-            _parseString(t[point],res);
-            point++;
         }
     }
-    return _parseInt(t[0]);
+    *out=stack[0];
+    return GRAPHICAL_OK;
 }
 
-int compute(char *value) {
-    p=p1=0;
-    int infixNum=_toInfixExpression(value);
-    _parseSuffixExpression(infixList,infixNum);
-    int ans=_calculate();
-    return ans;
+//批量计算，columns[k] 是第 k 个变量的一列数据，每列 n 行，结果写入 out
+//整个批量都用 double 计算，出错时停下，出错的行号写入 failed_row
+GRAPHICAL_API int graphical_eval_batch(const program *prog,const double *const *columns,long long n,double *out,long long *failed_row) {
+    double small[32];
+    double *stack=small;
+    if(prog->max_depth>32) {
+        stack=malloc(prog->max_depth*sizeof(double));
+        if(!stack) return GRAPHICAL_MEMORY;
+    }
+    int status=GRAPHICAL_OK;
+    for(long long row=0;row<n;row++) {
+        status=_execute_double(prog,columns,row,stack,&out[row]);
+        if(status!=GRAPHICAL_OK) {
+            *failed_row=row;
+            break;
+        }
+    }
+    if(stack!=small) free(stack);
+    return status;
 }
 
-/*
-int main() {
-    //输入字符串
-    while(1) {
-        int a;
-        a = compute("1+1");
-        printf("\n%d\n",a);
-        p=p1=0;
-        printf("------------------------------\n");
-        printf("Please enter the expression to be calculated:");
-        scanf("%s",s);
-        int infixNum=_toInfixExpression(s);
-        _parseSuffixExpression(infixList,infixNum);
-        printf("The calculation process is as follows:\n");
-        int ans=_calculate();
-        printf("The operation result is: %d\n",ans);
-        printf("------------------------------\n");
-        printf("Please choose whether to continue (enter 0 to exit, otherwise continue):");
-        int opt;
-        scanf("%d",&opt);
-        if(opt==0) break;
-        printf("\n");
-
-    }
-}
-*/
+//旧的接口，只能返回整数，出错时返回-1
+GRAPHICAL_API int compute(const char *expression) {
+    graphical_value value;
+    if(graphical_compute(expression,&value)!=GRAPHICAL_OK) return -1;
+    if(value.type==GRAPHICAL_FLOAT) return (int)value.d;
+    return (int)value.i;
+}
@@ -16,7 +16,15 @@
 
 以下是核心部分的声明：
 
-def compute(equation: str, **kwargs) -> int or float: ...
+def compute(equation: str, c_extend: bool = None, **kwargs) -> int or float: ...
+
+def compute_batch(equation: str, out=None, **columns) -> array: ...
+
+compile_cache: _LRUCache
+
+formula_registry: weakref.WeakValueDictionary
+
+engine: _Engine
 
 class Graphical_metaclass(type):
     def __new__(cls, name: str, bases: tuple, classdict: dict) -> type: ...
@@ -57,30 +65,110 @@ class Integrated_Graphical(object):
 
 def loadfromJSON(json: str) -> type: ...
 
+def loadfromJSONLines(source, onerror=None, encoding: str = "utf-8"): ...
+
+def buildAlltoJSON(file, formulas=None, indent: int = None) -> int: ...
+
+class Graphical_library(object):
+
+    def __init__(self, path: str, encoding: str = "utf-8") -> None: ...
+
+    def __getitem__(self, key: str) -> type: ...
+
+    def get(self, key: str, default=None) -> type: ...
+
+    def __contains__(self, key: str) -> bool: ...
+
+    def __len__(self) -> int: ...
+
+    def keys(self): ...
+
+    def names(self): ...
+
+    def loaded(self) -> dict: ...
+
+def buildtoBundle(kinds, file) -> int: ...
+
+def loadfromBundle(path: str) -> Graphical_bundle: ...
+
+class Graphical_bundle(object):
+
+    def __init__(self, path: str) -> None: ...
+
+    def __getitem__(self, key) -> type: ...
+
+    def get(self, key, default=None) -> type: ...
+
+    def __contains__(self, key) -> bool: ...
+
+    def __len__(self) -> int: ...
+
+    def names(self): ...
+
+    def close(self) -> None: ...
+
+def evaluate_parallel(jobs, max_workers: int = None, chunk_size: int = 256, return_exceptions: bool = False) -> list: ...
+
+async def evaluate_async(jobs, executor=None, chunk_size: int = 256, max_concurrency: int = 4, return_exceptions: bool = False) -> list: ...
+
+def evaluate_stream(jobs, executor=None, chunk_size: int = 256, max_concurrency: int = 4, return_exceptions: bool = False): ...
+
 """
 
 #导入需要的模块
 import argparse  # 用于解析参数
 import ast  # 用于解析抽象语法树
+import csv  # 批量计算读取CSV
 import fractions  # 用于分数支持
+import hashlib  # 公式包的内容哈希
+import importlib.util  # 公式包里字节码的版本
+import marshal  # 公式包里保存字节码
+import mmap  # 打开公式包
+import os  # 用于查找动态链接库
 import re
 from re import error  # 正则表达式
+import selectors  # 计算服务等待空闲的长连接
+import socket  # 计算服务关闭连接
+import struct  # 公式包的文件头和索引
 import sys  # 系统调用
-from ctypes import cdll  # 用于加载dll
+import threading  # 线程锁
+import time  # 缓存的过期时间
+import weakref  # 公式注册表只保存弱引用
+from array import array  # 批量计算时使用的连续数组
+from collections import OrderedDict  # 有序字典，用于LRU缓存
+from collections.abc import Mapping  # 批量计算时区分按列和按行传入的数据
+from ctypes import (  # 用于加载dll
+    POINTER, Structure, byref, c_char_p, c_double, c_int, c_longlong, c_void_p,
+    cast, cdll
+)
 from decimal import Decimal  # 精确的浮点数
+from itertools import chain, islice, repeat  # 把单个值广播到每一行，批量读取
 from json import dumps, loads  # json支持
-
-FORMULA = None
-ARGS = None
-EXTENSION = None
+from http.server import BaseHTTPRequestHandler, HTTPServer  # 计算服务
+from types import MappingProxyType  # 只读的参数和扩展字典
 
 __all__ = [    #模块接口列表
     'compute',
+    'compute_batch',
+    'compile_cache',
+    'engine',
     'Graphical',
     'Extension',
     'parameter',
     'Integrated_Graphical',
     'loadfromJSON',
+    'buildAlltoJSON',
+    'loadfromJSONLines',
+    'buildtoBundle',
+    'loadfromBundle',
+    'Graphical_bundle',
+    'evaluate_parallel',
+    'evaluate_async',
+    'evaluate_stream',
+    'Graphical_server',
+    'serve',
+    'batch',
+    'Graphical_library',
     '正方形',
     'square',
     '正方形面积',
@@ -132,96 +220,639 @@ __all__ = [    #模块接口列表
     'Marketing'
 ]
 
-def compute(equation,c_extend=True,**kwargs):
-    """计算字符串表达式
+class _LRUCache(object):
+    """
+    线程安全的LRU缓存
 
     参数:
-    equation (str) --> 表达式本身
-    c_extend=True (bool) --> 是否启用c扩展
-    **kwargs (dict) --> 全局作用域
+        maxsize (int) 最多缓存的条目数，None 表示不限制，0 表示不缓存
+        ttl (float) 条目的有效时间(秒)，None 表示一直有效
     
-    返回:
-    一个整数或浮点数"""
+    方法:
+        get 获取缓存，没有时调用工厂函数生成并保存
+        cache_info 获取命中统计
+        cache_clear 清空缓存
+        resize 重新设置缓存大小
+    """
+    def __init__(self,maxsize=128,ttl=None):
+        self.maxsize = maxsize    #保存缓存大小
+        self.ttl = ttl    #有效时间
+        self.hits = 0    #命中次数
+        self.misses = 0    #未命中次数
+        self._data = OrderedDict()    #按使用顺序排列的缓存
+        self._expires = {}    #设置了有效时间时，保存每个条目的过期时间
+        self._lock = threading.Lock()    #多线程下保护缓存
+
+    def get(self,key,factory):
+        """获取 key 对应的值，没有时用 factory(key) 生成"""
+        with self._lock:
+            try:
+                value = self._data[key]    #尝试命中
+                if self.ttl is not None and self._expires[key] <= time.monotonic():
+                    #已经过期了
+                    del self._data[key], self._expires[key]
+                    raise KeyError(key)
+            except KeyError:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._data.move_to_end(key)    #标记为最近使用
+                return value
+        #生成值时不持有锁，免得编译大表达式时阻塞其他线程
+        value = factory(key)
+        self.put(key,value)
+        return value
+    
+    def put(self,key,value):
+        """直接放入一个值"""
+        with self._lock:
+            if self.maxsize == 0:    #不缓存
+                return
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if self.ttl is not None:
+                self._expires[key] = time.monotonic() + self.ttl
+            self._evict()
+    
+    def _evict(self):
+        #淘汰最久没有使用的条目，调用前需要持有锁
+        if self.maxsize is None:
+            return
+        while len(self._data) > self.maxsize:
+            key, value = self._data.popitem(last=False)
+            self._expires.pop(key, None)
+
+    def resize(self,maxsize):
+        """重新设置缓存大小"""
+        with self._lock:
+            self.maxsize = maxsize
+            if maxsize == 0:
+                self._data.clear()
+                self._expires.clear()
+            self._evict()
+
+    def cache_info(self):
+        """返回 (命中次数, 未命中次数, 缓存大小, 当前条目数)"""
+        with self._lock:
+            return self.hits, self.misses, self.maxsize, len(self._data)
+    
+    def cache_clear(self):
+        """清空缓存和统计"""
+        with self._lock:
+            self._data.clear()
+            self._expires.clear()
+            self.hits = self.misses = 0
+    
+    def __len__(self):
+        return len(self._data)
+    
+    def __contains__(self,key):
+        return key in self._data
 
-    #其实这个c扩展的计算bug（不，是特性！）有很多，
-    #比如说不支持浮点数、除法计算有误差、不支持扩展等等
-    #但是还是很有用的。
-    #虽然一般来说这个用处不大，
-    #但是如果对于CPU密集计算（疯狂计算）的时候，
-    #其实是能提高一点速度（我做过测试）
-
-    def py_compute(equation,**kwargs):
-        #返回标准python的eval计算
-        #主要是c的缺陷
-        return eval(equation,kwargs,{})
-    
-    if sys.platform != 'win32':
-        c_extend = False
-
-    if c_extend:
-        class eval_visit(ast.NodeVisitor):
-            """遍历源码树"""
-            def __init__(self):
-                """初始化"""
-                self.truediv = False
-                self.hasfloat = False
-            
-            def visit_BinOp(self,node):
-                """表达式调用"""
-                if isinstance(node.op,ast.Div):    #判断是不是除法
-                    self.truediv = True
-                self.generic_visit(node)    #处理后续工作
-                return node
-            
-            def visit_Constant(self,node):
-                """遇到数字"""
-                if isinstance(node.s,float):    #如果是浮点数
-                    self.hasfloat = True
-                self.generic_visit(node)    #处理后续工作
-                return node
+def _compile_equation(equation):
+    #把表达式编译成字节码
+    return compile(equation,"<graphical>","eval")
 
-                 
-        source = ast.parse(equation)    #解析代码，生成抽象语法树
-        code = eval_visit()    #初始化遍历对象
-        code.visit(source)    #遍历
-        if code.truediv:    #如果有除法运算
-            #返回eval运算，因为不精确……
-            return py_compute(equation,**kwargs)
-        
-        if code.hasfloat:    #判断是不是浮点数
-            #返回eval运算，因为不支持……
-            return py_compute(equation,**kwargs)
+#表达式文本 -> 字节码 的缓存
+#可以用 compile_cache.resize(n) 调整大小
+compile_cache = _LRUCache(maxsize=1024)
 
-        if len(kwargs) != 0:    #判断有没有扩展
-            #因为，我不知道怎么在C语言里使用python函数
-            return py_compute(equation,**kwargs)
+def _library_name():
+    """获取当前平台的动态链接库名称
 
+    Windows 使用仓库里编译好的 dll，
+    其他平台需要先用 make 编译出 libgraphical.so"""
+    if sys.platform == 'win32':
         #判断系统位数，在64位的python调用32位的dll会报错
         bit = re.findall(r".*\[.*(\d\d) bit.*\].*",sys.version)[0]
         dll_bit_list = {
             '32':'win32',
             '64':'amd64'
         }
-        dll_name = 'libgraphical.{bit}.dll'.format(bit=dll_bit_list[bit])
-        try:
-            #导入dll
-            dll = cdll.LoadLibrary('.\\' + dll_name)
-        except FileNotFoundError:    #找不到会报错，捕获错误
-            #就返回普通的计算
+        return 'libgraphical.{bit}.dll'.format(bit=dll_bit_list[bit])
+    return 'libgraphical.so'
+
+class _eval_visit(ast.NodeVisitor):
+    """遍历源码树，判断表达式能不能交给c扩展计算"""
+    #c扩展认识的语法
+    supported = (
+        ast.Expression, ast.BinOp, ast.UnaryOp,
+        ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.USub, ast.UAdd
+    )
+
+    def __init__(self,names=()):
+        """初始化
+
+        names 是批量计算时可以使用的变量名"""
+        self.names = names
+        self.unsupported = False
+    
+    def visit_Name(self,node):
+        """变量"""
+        if node.id not in self.names:
+            self.unsupported = True
+        return node
+
+    def generic_visit(self,node):
+        """其他语法，比如变量、函数调用"""
+        if not isinstance(node,self.supported):
+            self.unsupported = True
+            return node
+        super().generic_visit(node)    #处理后续工作
+        return node
+    
+    def visit_Constant(self,node):
+        """遇到数字"""
+        if type(node.value) not in (int,float):    #字符串、布尔值、复数等
+            self.unsupported = True
+        return node
+
+def _native_feasible(equation):
+    """判断表达式能不能交给c扩展计算"""
+    try:
+        source = ast.parse(equation, mode="eval")    #解析代码，生成抽象语法树
+    except SyntaxError:    #交给 eval 去报错
+        return False
+    code = _eval_visit()    #初始化遍历对象
+    code.visit(source)    #遍历
+    return not code.unsupported
+
+def _native_feasible_batch(equation,names):
+    """判断带变量的表达式能不能交给c扩展批量计算"""
+    try:
+        source = ast.parse(equation, mode="eval")
+    except SyntaxError:
+        return False
+    code = _eval_visit(names)
+    code.visit(source)
+    return not code.unsupported
+
+class _Value(Structure):
+    """c扩展返回的带类型的数值"""
+    _fields_ = [
+        ("type", c_int),    #0 是整数，1 是浮点数
+        ("i", c_longlong),
+        ("d", c_double)
+    ]
+
+class _Program(object):
+    """c扩展编译好的表达式，这个对象被回收时释放c里的内存"""
+    def __init__(self,handle,free):
+        self.handle = handle
+        self._free = free
+
+    def __del__(self):
+        self._free(self.handle)
+
+def _as_doubles(column,writable=False):
+    """
+    把一列数据转为连续的 double 数组
+
+    参数:
+        column (object) NumPy 数组、支持缓冲区协议的对象或者序列
+        writable (bool) 是否需要写入，需要写入时不能复制
+
+    返回:
+        一个二元组 (需要保持引用的对象, ctypes 数组)
+    """
+    numpy = sys.modules.get("numpy")    #只有用户传入了 NumPy 数组时才会用到
+    if numpy is not None and isinstance(column, numpy.ndarray) and not writable:
+        column = numpy.ascontiguousarray(column, dtype=numpy.float64)
+    try:
+        view = memoryview(column)
+    except TypeError:    #普通的序列
+        if writable:
+            raise TypeError("out 必须是可写的 double 数组") from None
+        column = array('d', column)
+        view = memoryview(column)
+    if view.format != 'd' or view.ndim != 1 or not view.c_contiguous:
+        if writable:
+            raise TypeError("out 必须是一维、连续的 double 数组")
+        column = array('d', view.tolist())    #类型不对，转换一次
+        view = memoryview(column)
+    if view.readonly:
+        if writable:
+            raise TypeError("out 必须是可写的 double 数组")
+        return column, (c_double * len(view)).from_buffer_copy(view)
+    return column, (c_double * len(view)).from_buffer(view)
+
+class _Engine(object):
+    """
+    常驻的计算引擎
+
+    c扩展只在第一次使用时加载一次，参数类型也只声明一次，
+    每个表达式能不能用c扩展计算的判断结果也会缓存起来，
+    所以每次计算只剩下真正的调用
+
+    方法:
+        load 加载c扩展，返回计算函数，加载失败返回 None
+        evaluate 计算表达式，同时返回使用的后端
+        available 判断c扩展是否可用
+    """
+    NATIVE = 'c'    #c扩展
+    PYTHON = 'python'    #python的eval
+
+    def __init__(self):
+        self.path = None    #动态链接库的路径
+        self._function = None    #c扩展的 compute 函数
+        self._batch = None    #c扩展的批量计算函数
+        self._loaded = False    #是否尝试过加载
+        self.error = None    #加载失败的原因
+        self._lock = threading.Lock()
+        self.feasible = _LRUCache(maxsize=1024)    #表达式 -> 能否用c扩展计算
+        self.programs = _LRUCache(maxsize=256)    #(表达式, 变量名) -> 编译好的表达式
+
+    def load(self):
+        """加载c扩展，整个进程只会加载一次"""
+        if self._loaded:
+            return self._function
+        with self._lock:
+            if self._loaded:    #其他线程已经加载好了
+                return self._function
+            dll_name = _library_name()    #获取动态链接库的名称
+            #和模块放在同一个目录下
+            self.path = os.path.join(os.path.dirname(os.path.abspath(__file__)), dll_name)
+            #加载失败时不警告，直接用 Python 计算，
+            #只有明确要求使用c扩展时才会警告，见 require
+            try:
+                dll = cdll.LoadLibrary(self.path)    #导入dll
+            except OSError:    #找不到会报错，捕获错误
+                self.error = '找不到DLL: {}'.format(dll_name)
+            else:
+                try:
+                    function = dll.graphical_compute
+                except AttributeError:    #旧版本的dll没有这个接口
+                    self.error = 'DLL版本过旧，请重新编译: {}'.format(dll_name)
+                else:
+                    function.argtypes = [c_char_p, POINTER(_Value)]    #只声明一次参数类型
+                    function.restype = c_int
+                    self._function = function
+                    #批量计算的接口
+                    dll.graphical_compile.argtypes = [
+                        c_char_p, POINTER(c_char_p), c_int, POINTER(c_int)
+                    ]
+                    dll.graphical_compile.restype = c_void_p
+                    dll.graphical_free.argtypes = [c_void_p]
+                    dll.graphical_free.restype = None
+                    dll.graphical_eval_batch.argtypes = [
+                        c_void_p, POINTER(POINTER(c_double)), c_longlong,
+                        POINTER(c_double), POINTER(c_longlong)
+                    ]
+                    dll.graphical_eval_batch.restype = c_int
+                    self._batch = dll
+            self._loaded = True
+        return self._function
+
+    def available(self):
+        """c扩展是否可用"""
+        return self.load() is not None
+
+    def require(self):
+        """明确要求使用c扩展，不可用时发出警告"""
+        if (self._function if self._loaded else self.load()) is None:
             import warnings   #给你个警告
-            warnings.warn(
-                '找不到DLL: {}'.format(dll_name),
-                RuntimeWarning, -1
-            )
-            return py_compute(equation,**kwargs)
+            warnings.warn(self.error, RuntimeWarning, 3)
+
+    def evaluate(self,equation,**kwargs):
+        """
+        计算表达式
+
+        参数:
+            equation (str) 表达式本身
+            **kwargs (dict) 全局作用域
         
-        try:    #执行
-            return dll.compute(bytes(equation,"utf-8"))
-        except OSError:
-            return py_compute(equation,**kwargs)
+        返回:
+            一个二元组 (结果, 后端)，后端是 'c' 或 'python'
+        """
+        if not kwargs and self.feasible.get(equation,_native_feasible):
+            #因为，我不知道怎么在C语言里使用python函数，有扩展时不能用c扩展
+            function = self._function if self._loaded else self.load()
+            if function is not None:
+                value = _Value()
+                #状态不是0时，说明结果超出了范围、除以零等，交给 eval 处理
+                if function(equation.encode("utf-8"), byref(value)) == 0:
+                    return (value.i if value.type == 0 else value.d), self.NATIVE
+        #都不行调用eval
+        return eval(compile_cache.get(equation,_compile_equation),kwargs,{}), self.PYTHON
+
+    def _compile_program(self,key):
+        #用c扩展编译带变量的表达式，不支持时返回 None
+        equation, names = key
+        if not _native_feasible_batch(equation, names):
+            return None
+        status = c_int()
+        handle = self._batch.graphical_compile(
+            equation.encode("utf-8"),
+            (c_char_p * len(names))(*[name.encode("utf-8") for name in names]),
+            len(names), byref(status)
+        )
+        if not handle:
+            return None
+        return _Program(handle, self._batch.graphical_free)
+
+    def evaluate_batch(self,equation,columns,out=None):
+        """
+        批量计算表达式
+
+        参数:
+            equation (str) 表达式本身
+            columns (dict) 变量名 -> 一列数据，也可以是单个值
+            out (object) 可选，写入结果的 double 数组
+
+        返回:
+            一个二元组 (结果数组, 后端)
+        """
+        columns = {name: _as_column(value) for name, value in columns.items()}    #生成器等先转为列表
+        names = tuple(columns)
+        length = None
+        for value in columns.values():    #检查每一列的长度
+            if _is_column(value):
+                if length is None:
+                    length = len(value)
+                elif len(value) != length:
+                    raise ValueError("每一列的长度必须一样")
+        if length is None:    #全都是单个值
+            length = 1
+        keep = []    #保持引用，免得数组在计算时被回收
+        buffers = []
+        for value in columns.values():
+            if not _is_column(value):
+                value = array('d', [float(value)]) * length    #广播
+            obj, buffer = _as_doubles(value)
+            keep.append(obj)
+            buffers.append(buffer)
+
+        if out is None:    #输入有 NumPy 数组时返回 NumPy 数组
+            numpy = sys.modules.get("numpy")
+            if numpy is not None and any(
+                isinstance(value, numpy.ndarray) for value in columns.values()
+            ):
+                out = numpy.empty(length)
+            else:
+                out = array('d', bytes(8 * length))
+        obj, result = _as_doubles(out, writable=True)
+        if len(result) != length:
+            raise ValueError("out 的长度必须和输入一样")
+
+        if self._batch is None:
+            self.load()
+        program = None
+        if self._batch is not None:
+            program = self.programs.get((equation, names), self._compile_program)
+        code = compile_cache.get(equation, _compile_equation)
+
+        start = 0
+        if program is not None:
+            pointers = (POINTER(c_double) * len(buffers))(
+                *[cast(buffer, POINTER(c_double)) for buffer in buffers]
+            )
+            failed = c_longlong()
+            status = self._batch.graphical_eval_batch(
+                program.handle, pointers, length, result, byref(failed)
+            )
+            if status == 0:
+                return out, self.NATIVE
+            #从出错的那一行开始用 Python 计算，错误和c扩展不可用时一样
+            start = failed.value
+
+        #c扩展不可用，用 Python 逐行计算
+        for row in range(start, length):
+            value = eval(code, {name: buffer[row] for name, buffer in zip(names, buffers)}, {})
+            if isinstance(value, complex):    #比如负数的小数次方
+                raise ValueError("第 %d 行的结果不是实数: %r" % (row, value))
+            result[row] = value
+        return out, self.PYTHON
+
+#常驻的计算引擎，compute 使用它
+engine = _Engine()
+
+def compute(equation,c_extend=None,**kwargs):
+    """计算字符串表达式
+
+    参数:
+    equation (str) --> 表达式本身
+    c_extend=None (bool) --> 是否启用c扩展，None 时能用就用，
+                             True 时c扩展不可用会发出警告，False 时不使用
+    **kwargs (dict) --> 全局作用域
+    
+    返回:
+    一个整数或浮点数"""
+
+    #c扩展支持整数、浮点数和 + - * / ** 以及负号，
+    #整数用 int64 计算，浮点数用 double 计算，和 Python 的结果一样，
+    #超出 int64 的大整数、除以零等情况会交给 eval，由 Python 计算或报错
+    #不支持扩展，因为我不知道怎么在C语言里使用python函数
+    #对于CPU密集计算（疯狂计算）的时候，能提高一点速度
+
+    if c_extend:    #明确要求使用c扩展
+        engine.require()
+    if c_extend is not False:
+        return engine.evaluate(equation,**kwargs)[0]
+
+    #返回标准python的eval计算
+    return eval(compile_cache.get(equation,_compile_equation),kwargs,{})
+
+def compute_batch(equation,out=None,**columns):
+    """批量计算字符串表达式
+
+    整个批量只调用一次c扩展，全部用 double 计算，
+    c扩展不可用时用 Python 逐行计算
+
+    参数:
+    equation (str) --> 表达式本身
+    out=None (object) --> 写入结果的 double 数组，比如 NumPy 数组或 array('d')
+    **columns (dict) --> 每个变量对应一列数据(NumPy 数组、支持缓冲区协议的对象或序列)
+    
+    返回:
+    一个 double 数组，传入了 out 时就是 out 本身
+
+    示例:
+    compute_batch("(a+b+h)*4", a=[1,2], b=[2,3], h=[3,4])  # array('d', [24.0, 36.0])"""
+    return engine.evaluate_batch(equation,columns,out)[0]
 
-    #都不行调用eval
-    return eval(equation,kwargs,{})
+#惰性求值最早是专门为圆形设计的
+#现在公式的源码文本也用它按需生成
+class _lazy_property(object):
+    """惰性求值 描述符
+
+    slot 是使用 __slots__ 的类里保存结果的槽位，没有 __dict__ 时使用"""
+    def __init__(self,fget,slot=None):
+        self.fun = fget    #初始化
+        self.slot = slot
+    
+    def __get__(self, instance, owner):
+        if instance is None:    #如果是类调用
+            return self    #返回本身
+        if self.slot is not None:    #结果保存在槽位里
+            try:
+                return self.slot.__get__(instance, owner)    #已经计算过了
+            except AttributeError:
+                pass
+            value = self.fun(instance)    #计算结果
+            self.slot.__set__(instance, value)    #存放结果
+            return value
+        value = self.fun(instance)    #计算结果
+        setattr(instance,self.fun.__name__, value)    #存放结果
+        return value    #返回结果
+
+#文本参数里的运算，和c扩展认识的运算一样
+_literal_operators = {
+    ast.Add: lambda a, b: a + b,
+    ast.Sub: lambda a, b: a - b,
+    ast.Mult: lambda a, b: a * b,
+    ast.Div: lambda a, b: a / b,
+    ast.Pow: lambda a, b: a ** b,
+    ast.UAdd: lambda a: +a,
+    ast.USub: lambda a: -a,
+}
+
+_literal_max_bits = 4096    #文本参数里乘方结果的最大位数，免得 "9**9**9**9" 算不完
+
+def _arithmetic(node, text):
+    """计算只有数字和运算符的语法树，其他语法引发 ValueError"""
+    if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+        return node.value
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _literal_operators:
+        return _literal_operators[type(node.op)](_arithmetic(node.operand, text))
+    if isinstance(node, ast.BinOp) and type(node.op) in _literal_operators:
+        left = _arithmetic(node.left, text)
+        right = _arithmetic(node.right, text)
+        if isinstance(node.op, ast.Pow) and type(left) is int and type(right) is int \
+                and abs(left) > 1 and right > 0 and left.bit_length() * right > _literal_max_bits:
+            raise ValueError("参数里的数字太大: %r" % (text,))
+        return _literal_operators[type(node.op)](left, right)
+    raise ValueError("无法识别的参数: %r" % (text,))
+
+def _literal(value):
+    """把参数转为可以计算的值
+
+    以前参数是以文本的形式替换进公式的，
+    所以命令行传进来的 "3" 和 "1+2" 也能当作数字计算，这里保持这个行为；
+    文本只能是字面量或者数字的四则运算和乘方，其他的引发 ValueError，不会执行任何代码，
+    乘方的结果太大时也引发 ValueError"""
+    if value.__class__ is not str:    #数字等直接使用
+        return value
+    try:
+        return ast.literal_eval(value)    #大部分情况是数字
+    except (ValueError, SyntaxError):
+        pass
+    try:
+        tree = ast.parse(value, mode="eval")
+    except SyntaxError:
+        raise ValueError("无法识别的参数: %r" % (value,)) from None
+    return _arithmetic(tree.body, value)    #只有数字和运算符，没有名称和函数调用
+
+def _request_arguments(kind, kwargs):
+    """检查计算服务和批量计算收到的参数
+
+    公式只接受数字，或者 ast.literal_eval 能解析成数字的文本，
+    其他的引发 ValueError，不会当作表达式计算；
+    文章(Graphical_str_compose)只把参数转为字符串，文本和数字原样传入"""
+    if not isinstance(kwargs, dict):
+        raise ValueError("参数必须是一个JSON对象")
+    arguments = {}
+    compose = isinstance(kind, type) and issubclass(kind, Graphical_str_compose)
+    for key, value in kwargs.items():
+        if compose:
+            if not isinstance(value, (str, int, float)):
+                raise ValueError("参数 %s 必须是文本或数字: %r" % (key, value))
+            arguments[key] = value
+            continue
+        if isinstance(value, str):
+            try:
+                value = ast.literal_eval(value)
+            except (ValueError, SyntaxError):
+                raise ValueError("参数 %s 不是数字: %r" % (key, value)) from None
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            raise ValueError("参数 %s 不是数字: %r" % (key, value))
+        arguments[key] = value
+    return arguments
+
+def _import_numpy():
+    """尝试导入 NumPy，没有安装时返回 None
+
+    NumPy 是可选依赖，只有批量计算时才会用到"""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+def _is_column(value):
+    #判断是一列数据还是单个值，单个值会被广播到每一行
+    return hasattr(value, '__iter__') and not isinstance(value, (str, bytes))
+
+def _as_column(value):
+    #生成器等没有长度的列先转为列表，单个值和有长度的列不变
+    if _is_column(value) and not hasattr(value, '__len__'):
+        return list(value)
+    return value
+
+def _column_rows(values):
+    """把列和单个值组合成逐行的参数，单个值广播到每一行
+
+    每一列的长度必须一样，和 compute_batch 一样引发 ValueError，不会按最短的一列截断"""
+    length = None
+    for value in values:
+        if _is_column(value):
+            if length is None:
+                length = len(value)
+            elif len(value) != length:
+                raise ValueError("每一列的长度必须一样")
+    if length is None:    #全都是单个值
+        return [values]
+    return zip(*[value if _is_column(value) else repeat(value, length) for value in values])
+
+def _vector_namespace(extension, numpy):
+    """把扩展转为可以和 NumPy 数组一起计算的全局变量"""
+    namespace = {}
+    for name, value in extension.items():
+        if isinstance(value, (Decimal, fractions.Fraction)):
+            #NumPy 数组不能和 Decimal、Fraction 一起计算，转为浮点数
+            value = float(value)
+        elif callable(value):
+            #math 模块的函数换成同名的 NumPy 函数，其他的逐个元素调用
+            ufunc = getattr(numpy, getattr(value, "__name__", ""), None)
+            if getattr(value, "__module__", None) == "math" and callable(ufunc):
+                value = ufunc
+            else:
+                value = numpy.vectorize(value)
+        namespace[name] = value
+    return namespace
+
+def _deferred_error(error):
+    """公式编译失败时，把错误推迟到计算时再引发"""
+    def function(*args):
+        raise error
+    return function
+
+_result_cache_lock = threading.Lock()    #创建结果缓存时使用
+
+#用 class 语句定义的公式类，类名 -> 类，加载 JSON 时按 depends 里的名称查找依赖；
+#公式里的名称不会到这里找，只有写在 depends 里的公式才会被引用；
+#只保存弱引用，类不再使用时会自动移除；
+#从 JSON、公式库、公式包加载的类不会注册，免得覆盖内置公式
+formula_registry = weakref.WeakValueDictionary()
+
+def _lookup_formula(name, namespace=None):
+    """按 depends 里的名称查找公式类，先在 namespace 里找，再到 formula_registry 里找"""
+    if namespace is not None:
+        kind = namespace.get(name)
+        if kind is not None:
+            return kind
+    return formula_registry.get(name)
+
+def _memoize_key(arguments):
+    """生成结果缓存的键
+
+    同时比较类型和值，免得 2 和 2.0 的结果混在一起，
+    参数不能哈希(比如数组)时返回 None，不使用缓存"""
+    key = tuple((value.__class__, value) for value in arguments)
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
 
 class Graphical_metaclass(type):
     """这个是Graphical类的元类，不应该被修改"""
@@ -253,7 +884,8 @@ class Graphical_metaclass(type):
                 key_value[key] = value
 
         classdict["formula"] = formula    #将必要参数formula和args写入类字典
-        classdict["_args"] = key_value
+        #编译好的公式不可修改，多线程共用时不会被改掉
+        classdict["_args"] = MappingProxyType(dict(key_value))
 
 
         #如果有扩展参数这一步将会执行
@@ -277,11 +909,36 @@ class Graphical_metaclass(type):
 
                 _extension = {_extension.get_name():_extension.get_function()}    #加入字典
             
-            classdict["extension"] = _extension    #将可选参数extension加入类字典
+            classdict["extension"] = MappingProxyType(_extension)    #将可选参数extension加入类字典，同样不可修改
 
         #没有跳到这里
 
-        return type.__new__(cls,name,bases,classdict)    #返回处理好后的对象
+        #紧凑模式，实例只保存参数元组和结果，没有 __dict__
+        compact = classdict.get("compact", any(getattr(base, "compact", False) for base in bases))
+        if compact:
+            if any(hasattr(base, "_result") for base in bases):    #父类已经有槽位了
+                classdict.setdefault("__slots__", ())
+            else:
+                classdict.setdefault("__slots__", ("_arguments", "_result"))
+
+        #加载公式时用 _namespace 指定依赖的公式从哪里找，并且不注册
+        namespace = classdict.pop("_namespace", None)
+        register = classdict.pop("_register", True)
+        precompiled = classdict.pop("_precompiled", None)    #公式包里编译好的字节码
+        kind = type.__new__(cls,name,bases,classdict)    #构建类
+        if precompiled is None:
+            kind._compile(namespace)    #每个类只编译一次公式
+        else:
+            kind._compile(namespace, precompiled)
+        if register:
+            formula_registry[name] = kind    #注册公式
+
+        if compact:
+            #结果放进槽位，公式文本和参数字典需要时再生成，不保存
+            kind._value = _lazy_property(Graphical.__dict__["_value"].fun, slot=kind._result)
+            kind._formula = property(Graphical.__dict__["_formula"].fun)
+            kind.kwargs = property(lambda self: dict(zip(self._params, self._arguments)))
+        return kind    #返回处理好后的对象
 
 
 class Graphical(object,metaclass=Graphical_metaclass):
@@ -295,6 +952,16 @@ class Graphical(object,metaclass=Graphical_metaclass):
     方法:
         buildtoJSON 构建成json字符串，持久化
     
+    选项:
+        lazy (bool) 惰性求值，第一次读取结果时才计算
+        compact (bool) 紧凑模式，实例只保存参数和结果
+        memoize (bool) 缓存相同参数的计算结果
+        depends (type or tuple) 公式里引用的其他公式
+
+    缓存方法:
+        cache_info 获取结果缓存的命中统计
+        cache_clear 清空结果缓存
+
     示例:
 
     class test(Graphical):
@@ -302,26 +969,267 @@ class Graphical(object,metaclass=Graphical_metaclass):
         args = parameter(a="a",b="b")
     a = test(a=2,b=3)  # 6
     """
+    #惰性求值开关
+    #为 True 时构造对象只绑定参数，第一次读取结果时才计算
+    #在某个公式类上设置只影响这个类，设置 Graphical.lazy 则对所有公式生效
+    lazy = False
+
+    #紧凑模式开关
+    #为 True 时实例使用 __slots__，只保存参数元组和结果，适合保存大量结果对象
+    #此时 kwargs 和 _formula 在读取时才根据参数生成
+    compact = False
+
+    #结果缓存开关
+    #为 True 时相同参数的计算结果会被缓存，重复构造对象时不再计算
+    #memoize_maxsize 是最多缓存的结果数，memoize_ttl 是结果的有效时间(秒)
+    memoize = False
+    memoize_maxsize = 128
+    memoize_ttl = None
+
+    #依赖的公式，一个公式类或者公式类的元组
+    #公式里只有写在这里的类名才会当作其他公式，其他名称(比如 abs)不会被同名的类替换
+    depends = ()
+
+    __slots__ = ()    #没有开启紧凑模式的子类仍然有 __dict__
+
     def __init__(self, **kwargs):
-        self.kwargs = kwargs    #保存公式参数
-        
-        trans = {}    #初始化映射表
-        for key, value in self._args.items():    #迭代参数列表
-            if key not in kwargs.keys():    #检查是否传入参数，
+        if not self.compact:
+            self.kwargs = kwargs    #保存公式参数
+        self._arguments = self._bind(kwargs)    #按顺序取出参数
+        if not self.lazy:    #不是惰性求值
+            self._value    #立即计算并保存结果
+
+    @_lazy_property
+    def _value(self):
+        """计算结果，惰性求值时在第一次读取时计算并保存"""
+        if self.memoize:
+            key = _memoize_key(self._arguments)
+            if key is not None:    #参数可以作为缓存的键
+                return self._result_cache().get(key, self._evaluate)
+        return self._function(*self._arguments)
+
+    def _evaluate(self, key=None):
+        #缓存没有命中时调用
+        return self._function(*self._arguments)
+
+    @classmethod
+    def _result_cache(cls):
+        """获取这个类的结果缓存，第一次使用时创建"""
+        cache = cls.__dict__.get("_results")
+        if cache is None:
+            with _result_cache_lock:
+                cache = cls.__dict__.get("_results")
+                if cache is None:
+                    cache = _LRUCache(maxsize=cls.memoize_maxsize, ttl=cls.memoize_ttl)
+                    cls._results = cache
+        return cache
+
+    @classmethod
+    def cache_info(cls):
+        """返回结果缓存的 (命中次数, 未命中次数, 缓存大小, 当前条目数)"""
+        return cls._result_cache().cache_info()
+
+    @classmethod
+    def cache_clear(cls):
+        """清空结果缓存"""
+        cls._result_cache().cache_clear()
+
+    @classmethod
+    def _compile(cls, namespace=None, precompiled=None):
+        """把公式编译成带参数的函数，由元类在创建类时调用
+
+        公式里可以用类名引用 depends 里的其他公式，比如 "square_area*a"，
+        依赖的公式在定义时绑定，计算时按拓扑顺序先计算，每个只计算一次
+
+        参数:
+            namespace (dict) 类名 -> 公式类，公式库、公式包加载时引用同一个库里的公式
+            precompiled (tuple) 公式包里保存的 (依赖的公式名, 函数源码, 字节码)，
+                                传入时不再解析公式，也不经过 compile_cache"""
+        cls._params = tuple(cls._args.keys())    #传入的参数名
+        cls._deps = ()    #直接依赖的公式
+        cls._plan = ()    #所有依赖的公式，按计算顺序排列
+        if precompiled is not None:
+            names, cls._source, code = precompiled
+            cls._deps = cls._bind_dependencies(names, namespace)
+            cls._plan = cls._resolve_plan()
+        else:
+            try:
+                tree = ast.parse(cls.formula, mode="eval")
+                cls._deps = cls._find_dependencies(tree, namespace)
+                cls._plan = cls._resolve_plan()
+                #公式里的参数名和依赖的公式名就是函数的形参
+                cls._source = "lambda {}: ({})".format(
+                    ", ".join(tuple(cls._args.values()) + tuple(kind.__name__ for kind in cls._deps)),
+                    cls.formula
+                )
+                code = compile_cache.get(cls._source, _compile_equation)
+            except SyntaxError as error:    #公式写错了
+                #以前这个错误在计算时才会引发，这里保持一致
+                cls._source = None
+                cls._raw = cls._function = staticmethod(_deferred_error(error))
+                return
+        #公式不经过c扩展计算：扩展(比如 Decimal 的圆周率)在c里无法保持精度，
+        #而且每次调用c扩展都要传入并解析文本，比调用编译好的函数慢
+        namespace = dict(getattr(cls, "extension", None) or {})    #扩展作为全局变量
+        cls._raw = staticmethod(eval(code, namespace))    #需要传入依赖的结果
+        cls._function = staticmethod(cls._link(cls._raw, lambda kind: kind._raw))
+
+    @classmethod
+    def _find_dependencies(cls, tree, namespace=None):
+        """找出公式里引用的其他公式，只在 depends 和 namespace 里找"""
+        depends = cls.depends
+        if isinstance(depends, type):    #只依赖一个公式
+            depends = (depends,)
+        known = dict(namespace or {})
+        for kind in depends:
+            if not isinstance(kind, type):
+                raise TypeError("'%s' 的 depends 只能包含公式类: %r" % (cls.__name__, kind))
+            known[kind.__name__] = kind
+        #参数和扩展的名称不会当作公式
+        names = set(cls._args.values()) | set(getattr(cls, "extension", None) or {})
+        deps = []
+        for node in ast.walk(tree):
+            if not isinstance(node, ast.Name) or node.id in names:
+                continue
+            names.add(node.id)
+            if node.id == cls.__name__:
+                raise TypeError("公式之间存在循环依赖: %s -> %s" % (node.id, node.id))
+            kind = known.get(node.id)
+            if kind is None:    #不是公式，比如内置函数
+                continue
+            cls._check_dependency(kind)
+            deps.append(kind)
+        return tuple(deps)
+
+    @classmethod
+    def _bind_dependencies(cls, names, namespace=None):
+        """按名称找到已知的依赖，用于公式包里编译好的公式"""
+        deps = []
+        for name in names:
+            kind = _lookup_formula(name, namespace)
+            if kind is None:
+                raise TypeError("'%s' 依赖的公式 '%s' 不存在" % (cls.__name__, name))
+            cls._check_dependency(kind)
+            deps.append(kind)
+        return tuple(deps)
+
+    @classmethod
+    def _check_dependency(cls, kind):
+        #依赖的公式必须是编译好的公式，参数必须能从这个公式的参数里得到
+        if getattr(kind, "_raw", None) is None:
+            raise TypeError("'%s' 不能依赖公式 '%s'" % (cls.__name__, kind.__name__))
+        for key in kind._params:
+            if key not in cls._params:
+                raise TypeError("'%s' 依赖的公式 '%s' 需要参数 '%s'" % (cls.__name__, kind.__name__, key))
+
+    @classmethod
+    def _resolve_plan(cls):
+        """把所有依赖的公式按拓扑顺序排列，并记录它们的参数在这个公式参数中的位置"""
+        order = []
+        def visit(kind):
+            for dep in kind._deps:
+                if dep not in order:
+                    visit(dep)
+            order.append(kind)
+        for dep in cls._deps:
+            if dep not in order:
+                visit(dep)
+        return tuple(
+            (kind, tuple(cls._params.index(key) for key in kind._params))
+            for kind in order
+        )
+
+    @classmethod
+    def _link(cls, raw, raw_of):
+        """把依赖的公式连接起来，返回只需要传入参数的函数
+
+        raw_of(kind) 返回依赖的公式的函数(普通的或者向量化的)"""
+        if not cls._plan:    #没有依赖
+            return raw
+        steps = [(kind, raw_of(kind), index, kind._deps) for kind, index in cls._plan]
+        deps = cls._deps
+        def function(*arguments):
+            values = {}    #依赖的公式的结果，每个只计算一次
+            for kind, kind_raw, index, kind_deps in steps:
+                values[kind] = kind_raw(
+                    *[arguments[i] for i in index], *[values[dep] for dep in kind_deps]
+                )
+            return raw(*arguments, *[values[dep] for dep in deps])
+        return function
+
+    @classmethod
+    def _vector_raw(cls, numpy):
+        #在 NumPy 数组上计算的函数，需要传入依赖的结果
+        if "_vector_raw_function" in cls.__dict__:
+            return cls._vector_raw_function
+        namespace = _vector_namespace(getattr(cls, "extension", None) or {}, numpy)
+        function = eval(compile_cache.get(cls._source, _compile_equation), namespace)
+        cls._vector_raw_function = staticmethod(function)
+        return function
+
+    @classmethod
+    def _vectorize(cls, numpy):
+        """获取可以在 NumPy 数组上计算的公式函数，每个类只生成一次"""
+        if "_vector_function" in cls.__dict__:    #已经生成过了
+            return cls._vector_function
+        if cls._source is None:    #公式编译失败，交给原函数报错
+            return cls._function
+        function = cls._link(cls._vector_raw(numpy), lambda kind: kind._vector_raw(numpy))
+        cls._vector_function = staticmethod(function)
+        return function
+
+    @classmethod
+    def evaluate_many(cls, **columns):
+        """
+        批量计算公式
+
+        参数:
+            **columns (dict) 每个参数对应一列数据（数组或序列），也可以是单个值
+
+        返回:
+            安装了 NumPy 时返回一个数组，公式只在整个数组上计算一次；
+            否则逐行计算，返回一个列表
+
+        注意:
+            使用 NumPy 时，Decimal 和 Fraction 常量(比如圆周率)会转为浮点数
+
+        示例:
+        cuboid_volume.evaluate_many(a=[1,2], b=[3,4], h=[5,6])  # [15, 48]
+        """
+        values = []
+        for key in cls._params:    #按公式参数的顺序取出每一列
+            if key not in columns:
+                raise KeyError(key + " is not given")
+            values.append(_as_column(columns[key]))
+
+        numpy = _import_numpy()
+        if numpy is not None:    #向量化计算
+            arrays = [numpy.asarray(value) for value in values]
+            return numpy.asarray(cls._vectorize(numpy)(*arrays))
+
+        #没有 NumPy，逐行计算
+        function = cls._function
+        return [function(*map(_literal, row)) for row in _column_rows(values)]
+
+    @classmethod
+    def _bind(cls, kwargs):
+        """按公式参数的顺序取出参数值"""
+        arguments = []
+        for key in cls._params:    #迭代参数列表
+            if key not in kwargs:    #检查是否传入参数，
                 #如果必要的参数没有传入
                 raise KeyError(key + " is not given")    #引发错误并详细说明
-            trans[value] = str(kwargs[key])    #添加到映射表
-        
-        table = str.maketrans(trans)    #构建字符映射表
-        self._formula = self.formula.translate(table)    #替换
+            arguments.append(_literal(kwargs[key]))
+        return tuple(arguments)
 
-        #计算结果
-        if hasattr(self,"extension"):    #如果有扩展属性，说明有扩展模块
-            self._value = compute(self._formula,**self.extension)    #使用带扩展的计算
-            return
-        self._value = compute(self._formula, 
-                                c_extend=False
-                            )    #没有则使用普通的计算
+    @_lazy_property
+    def _formula(self):
+        """代入参数后的公式文本，只在需要时生成"""
+        trans = {}    #初始化映射表
+        for key, value in self._args.items():    #迭代参数列表
+            trans[value] = str(self.kwargs[key])    #添加到映射表
+        table = str.maketrans(trans)    #构建字符映射表
+        return self.formula.translate(table)    #替换
 
     def __call__(self):
         """计算结果"""
@@ -331,14 +1239,26 @@ class Graphical(object,metaclass=Graphical_metaclass):
     @classmethod    #这是一个类静态方法
     def buildtoJSON(cls):
         """构建参数字典"""
-        if hasattr(cls, "extension"):    #如果有扩展引发警告
-            raise Warning("扩展将会失效")    #因为我不知道如何存储扩展   
+        return dumps(cls._to_dict())    #解析返回json
+
+    @classmethod
+    def _to_dict(cls):
+        """构建保存字典，常量扩展(比如圆周率)也会保存"""
         dictionary = {    #构建保存字典
             'name':cls.__name__,
             'formula':cls.formula,
             'args':dict(cls._args.items())
         }
-        return dumps(dictionary)    #解析返回json
+        if cls._deps:    #依赖的公式按名称保存
+            dictionary['depends'] = [kind.__name__ for kind in cls._deps]
+        if getattr(cls, "extension", None):
+            try:
+                dictionary['extension'] = {
+                    name: _extension_to_json(value) for name, value in cls.extension.items()
+                }
+            except TypeError:    #函数之类的扩展无法保存，引发警告
+                raise Warning("扩展将会失效")
+        return dictionary
     
     #用多种方法都可以获取
     def __repr__(self):
@@ -417,76 +1337,1015 @@ class Integrated_Graphical(object):
 
     示例:
 
-    class test(Integrated_Graphical):
-        d : circle_area
-    a = test(r=1)
-    a.d
+    class test(Integrated_Graphical):
+        d : circle_area
+    a = test(r=1)
+    a.d
+
+    提示: 注解的用法是标记类型，但Python不会去检查它"""
+    def __init__(self,**kwargs):
+        """初始化图形"""
+        self.kwargs = kwargs    #保存参数
+        self.model = self._get_model()    #映射表，每个类只生成一次
+        self._results = {}    #每个公式的计算结果，每个实例中每个公式最多计算一次
+
+    @classmethod
+    def _get_model(cls):
+        """根据注解生成映射表"""
+        model = cls.__dict__.get('_model')
+        if model is None:
+            model = {}    #初始化映射表
+            annotations = getattr(cls, '__annotations__', None) or {}    #判断是否有注解
+            for name, func in annotations.items():    #遍历注解字典
+                #判断是否是公式对象
+                assert issubclass(func, Graphical) ,\
+                    '\'%s\' 不是公式对象 (他是 \'%s\')'%(name,func)    #不是报错
+                model[name] = func    #将键和值放入映射表
+            cls._model = model
+        return model
+
+    def _member(self, name):
+        """计算映射表里的公式，结果保存在实例里"""
+        func = self.model[name]    #取出公式
+        #用公式作为键，这样 area 和 面积 这样的别名共用一个结果
+        result = self._results.get(func)
+        if result is None:    #还没有计算过
+            result = self._results[func] = func(**self.kwargs)
+        return result
+
+    def getresult(self,name):
+        """这里是为了兼容之前的代码而设置的"""
+        #附带参数name为参数名称
+        #通过这里可以更灵活的计算
+        #由于这里被更好用的注解代替
+        #所以这里被用来报错
+        raise AttributeError('\'%s\' object has no attribute \'%s\'' % (self.__class__.__name__, name))
+    
+    def __getattr__(self, name):
+        """可以用xxx.x的方式获取结果"""
+        if name in self.model:    #判断目标是否在映射表里
+            return self._member(name)    #计算返回
+        function = getattr(self,'getresult', None)    #获取报错方法
+        return function(name)    #返回，如果重写了这个就不会直接报错
+    
+    def __call__(self,variable):
+        """也可以用xxx("x")的方式获取结果"""
+        if variable in self.model:    #判断函数是否在映射表里
+            return self._member(variable)    #返回计算结果
+        return self.getresult(variable)    #返回报错函数
+    
+    def __getitem__(self, key):
+        """还可以通过xxx['x']的方法获取结果"""
+        if self.model.get(key, None) is None:    #判断函数是否在映射表里
+            #如果不在
+            return self.getresult(key)    #返回报错函数
+        else:    #如果在
+            return self._member(key)._value    #返回计算结果
+
+    @classmethod
+    def _get_fused(cls):
+        """把所有成员的公式合并成一个函数，每个类只生成一次
+
+        返回:
+            (成员公式列表, 参数名列表, 函数)，不能合并时返回 None
+        """
+        if "_fused" in cls.__dict__:
+            return cls._fused
+        fused = _fuse_formulas(list(dict.fromkeys(cls._get_model().values())))
+        if fused is not None:
+            members, params, code, extension = fused
+            namespace = dict(extension)
+            exec(code, namespace)
+            fused = members, params, namespace["_fused"]
+        cls._fused = fused
+        return fused
+
+    @classmethod
+    def _get_fused_vector(cls, numpy):
+        """和 _get_fused 一样，但是函数可以在 NumPy 数组上计算"""
+        if "_fused_vector" in cls.__dict__:
+            return cls._fused_vector
+        fused = _fuse_formulas(list(dict.fromkeys(cls._get_model().values())))
+        if fused is not None:
+            members, params, code, extension = fused
+            namespace = _vector_namespace(extension, numpy)
+            exec(code, namespace)
+            fused = members, params, namespace["_fused"]
+        cls._fused_vector = fused
+        return fused
+
+    def evaluate_all(self):
+        """
+        一次计算所有成员
+
+        所有成员的公式被合并成一个函数，
+        公共的子表达式(比如 a*b)只计算一次
+
+        返回:
+            一个字典 {成员名称: 结果}
+        """
+        values = self.__dict__.get("_values")
+        if values is not None:    #已经计算过了
+            return dict(values)
+        fused = self._get_fused()
+        if fused is None:    #不能合并，逐个计算
+            values = {name: self[name] for name in self.model}
+        else:
+            members, params, function = fused
+            arguments = []
+            for key in params:    #按参数的顺序取出参数值
+                if key not in self.kwargs:
+                    raise KeyError(key + " is not given")
+                arguments.append(_literal(self.kwargs[key]))
+            results = dict(zip(members, function(*arguments)))
+            values = {name: results[func] for name, func in self.model.items()}
+        self._values = values
+        return dict(values)
+
+    as_dict = evaluate_all    #两个名字都可以用
+
+    @classmethod
+    def evaluate_table(cls, columns):
+        """
+        批量计算所有成员
+
+        参数:
+            columns (Mapping or iterable) 每个参数对应一列数据的映射(dict 等)，
+                                          或者每行一个参数字典的可迭代对象
+
+        返回:
+            一个字典 {成员名称: 一列结果}，安装了 NumPy 时每列是一个数组，
+            所有成员在整个数组上只计算一次；否则逐行计算，每列是一个列表
+
+        示例:
+        cuboid.evaluate_table({'a': [1, 2], 'b': [3, 4], 'h': [5, 6]})
+        cuboid.evaluate_table([{'a': 1, 'b': 3, 'h': 5}, {'a': 2, 'b': 4, 'h': 6}])
+        """
+        model = cls._get_model()
+        if not isinstance(columns, Mapping):    #每行一个字典，转为每个参数一列
+            rows = list(columns)
+            columns = {}
+            for kind in dict.fromkeys(model.values()):
+                for key in getattr(kind, "_params", ()):
+                    if key not in columns:
+                        try:
+                            columns[key] = [row[key] for row in rows]
+                        except KeyError:
+                            raise KeyError(key + " is not given") from None
+
+        numpy = _import_numpy()
+        fused = cls._get_fused() if numpy is None else cls._get_fused_vector(numpy)
+        if fused is None:    #不能合并，逐个成员批量计算
+            results = {}
+            for kind in dict.fromkeys(model.values()):
+                results[kind] = kind.evaluate_many(**columns)
+            return {name: results[kind] for name, kind in model.items()}
+
+        members, params, function = fused
+        values = []
+        for key in params:    #按参数的顺序取出每一列
+            if key not in columns:
+                raise KeyError(key + " is not given")
+            values.append(_as_column(columns[key]))
+
+        if numpy is not None:    #向量化计算
+            arrays = [numpy.asarray(value) for value in values]
+            results = numpy.broadcast_arrays(*arrays, *function(*arrays))[len(arrays):]
+            results = dict(zip(members, results))
+        else:    #没有 NumPy，逐行计算
+            results = [function(*map(_literal, row)) for row in _column_rows(values)]
+            results = dict(zip(members, map(list, zip(*results)))) if results else \
+                {kind: [] for kind in members}
+        return {name: results[kind] for name, kind in model.items()}
+
+
+def _formula_ast(kind):
+    """把公式解析成语法树，公式里的参数名换成传入的参数名，依赖的公式展开"""
+    rename = {value: key for key, value in kind._args.items()}
+    deps = {dep.__name__: dep for dep in kind._deps}
+
+    class _rename(ast.NodeTransformer):
+        def visit_Name(self, node):
+            if node.id in rename:
+                return ast.copy_location(ast.Name(id=rename[node.id], ctx=ast.Load()), node)
+            if node.id in deps:    #展开依赖的公式
+                return _formula_ast(deps[node.id])
+            return node
+
+    return _rename().visit(ast.parse(kind.formula, mode="eval").body)
+
+def _conditional_node(node):
+    """判断节点里的子表达式是不是不一定会计算，或者有自己的局部变量"""
+    if isinstance(node, (ast.IfExp, ast.BoolOp, ast.Lambda, ast.ListComp,
+                         ast.SetComp, ast.DictComp, ast.GeneratorExp)):
+        return True
+    return isinstance(node, ast.Compare) and len(node.ops) > 1    #连续比较会短路
+
+def _fuse_formulas(members):
+    """
+    把多个公式合并成一个函数，公共的子表达式只计算一次
+
+    参数:
+        members (list) 公式类列表
+
+    返回:
+        (成员公式列表, 参数名列表, 编译后的函数代码, 所有公式的扩展)，不能合并时返回 None
+    """
+    params = []    #函数的参数
+    namespace = {}    #所有公式的扩展
+    trees = []
+    for kind in members:
+        if getattr(kind, "_source", None) is None:    #文章或者写错的公式
+            return None
+        for key in kind._params:
+            if key not in params:
+                params.append(key)
+        for node in (kind,) + tuple(dep for dep, index in kind._plan):    #依赖的公式的扩展也需要
+            for name, value in (getattr(node, "extension", None) or {}).items():
+                if namespace.get(name, value) is not value:    #扩展重名但不是同一个
+                    return None
+                namespace[name] = value
+        trees.append(_formula_ast(kind))
+    if set(params) & set(namespace):    #参数和扩展重名
+        return None
+
+    #统计每个子表达式出现的次数，已经出现过的不再统计它的子节点；
+    #条件表达式、and/or、连续比较、lambda 和推导式里的子表达式不一定会计算，
+    #或者用到里面的局部变量，不统计也不提取
+    expression = (ast.BinOp, ast.UnaryOp, ast.Call)
+    counts = {}
+    def count(node):
+        if _conditional_node(node):
+            return
+        if isinstance(node, expression):
+            key = ast.dump(node)
+            counts[key] = counts.get(key, 0) + 1
+            if counts[key] > 1:
+                return
+        for child in ast.iter_child_nodes(node):
+            count(child)
+    for tree in trees:
+        count(tree)
+
+    #出现多次的子表达式提取成临时变量
+    temps = {}
+    lines = []
+    class _extract(ast.NodeTransformer):
+        def generic_visit(self, node):
+            if _conditional_node(node):    #原样保留
+                return node
+            if not isinstance(node, expression):
+                return super().generic_visit(node)
+            key = ast.dump(node)
+            if key in temps:    #已经计算过了
+                return ast.Name(id=temps[key], ctx=ast.Load())
+            node = super().generic_visit(node)
+            if counts[key] > 1:
+                name = temps[key] = "_common%d" % len(temps)
+                lines.append("    %s = %s" % (name, ast.unparse(node)))
+                return ast.Name(id=name, ctx=ast.Load())
+            return node
+    results = [ast.unparse(_extract().visit(tree)) for tree in trees]
+
+    source = "def _fused({}):\n{}\n    return ({},)\n".format(
+        ", ".join(params), "\n".join(lines), ", ".join(results)
+    )
+    try:
+        code = compile(source, "<graphical>", "exec")
+    except SyntaxError:    #参数名不能作为变量名等
+        return None
+    return tuple(members), tuple(params), code, namespace
+
+
+def loadfromJSON(json):
+    """
+    加载json公式
+
+    参数:
+        json (str) JSON字符串
+    
+    返回:
+        一个公式类对象
+    """
+    return _load_formula(loads(json))    #解析json
+
+def _extension_to_json(value):
+    """把常量扩展转为json可以保存的值，不能保存时引发 TypeError"""
+    if isinstance(value, bool) or not isinstance(value, (int, float, Decimal, fractions.Fraction)):
+        import math
+        name = getattr(value, "__name__", None)
+        if name is not None and getattr(math, name, None) is value:    #math 模块的函数按名称保存
+            return {"type": "math", "value": name}
+        raise TypeError("%r 不能保存" % (value,))
+    if isinstance(value, Decimal):
+        return {"type": "Decimal", "value": str(value)}
+    if isinstance(value, fractions.Fraction):
+        return {"type": "Fraction", "value": str(value)}
+    return value
+
+def _extension_from_json(value):
+    """_extension_to_json 的反向操作"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    if isinstance(value, dict):
+        kind, text = value.get("type"), value.get("value")
+        if kind == "Decimal":
+            return Decimal(text)
+        if kind == "Fraction":
+            return fractions.Fraction(text)
+        if kind == "math":
+            import math
+            function = getattr(math, text, None) if isinstance(text, str) else None
+            if callable(function):
+                return function
+    raise ValueError("无法识别的扩展: %r" % (value,))
+
+def _load_formula(dictionary, namespace=None, options=None):
+    """根据解析后的json字典构建公式类
+
+    加载的类不会注册到 formula_registry，
+    depends 里的公式先在 namespace 里找，再到 formula_registry 里找，
+    options 是 lazy、compact 之类的类属性"""
+    name = dictionary['name']
+    bases = (Graphical,)
+    classdict = dict(options or {})
+    classdict.update({
+        "formula":dictionary['formula'],
+        "args":dictionary['args'],
+        "_namespace":namespace,
+        "_register":False
+    })
+    if dictionary.get('depends'):    #依赖的公式
+        depends = []
+        for dep in dictionary['depends']:
+            kind = _lookup_formula(dep, namespace)
+            if kind is None:
+                raise TypeError("'%s' 依赖的公式 '%s' 不存在" % (name, dep))
+            depends.append(kind)
+        classdict["depends"] = tuple(depends)
+    if dictionary.get('extension'):    #常量扩展
+        classdict["extension"] = [
+            Extension(key, _extension_from_json(value))
+            for key, value in dictionary['extension'].items()
+        ]
+    kind = Graphical_metaclass(name, bases, classdict)    #构建类
+    return kind    #返回类
+
+def loadfromJSONLines(source, onerror=None, encoding="utf-8"):
+    """
+    逐行加载json公式，每行一个 buildtoJSON 生成的公式
+
+    一次只读取一行，构建好一个公式类就返回一个，
+    适合很大的文件或者网络连接；
+    生成的类不会注册到 formula_registry，不再使用时就会被回收，内存占用不会随行数增长
+
+    参数:
+        source (str or file) 文件路径，或者可以逐行迭代的对象(文件、socket.makefile() 等)
+        onerror (function) 遇到错误的行时调用 onerror(行号, 这一行, 错误)，
+                           没有传入时发出警告，然后继续加载
+        encoding (str) 文件编码，读取字节时也用它解码
+
+    返回:
+        一个生成器，逐个生成公式类
+
+    示例:
+    with open("formulas.jsonl") as file:
+        for kind in loadfromJSONLines(file):
+            print(kind.__name__)
+    """
+    if isinstance(source, (str, os.PathLike)):    #文件路径
+        with open(source, encoding=encoding) as file:
+            yield from loadfromJSONLines(file, onerror, encoding)
+        return
+    for number, line in enumerate(source, 1):
+        try:
+            if isinstance(line, (bytes, bytearray)):
+                line = line.decode(encoding)
+            if not line.strip():    #跳过空行
+                continue
+            dictionary = loads(line)
+            if not isinstance(dictionary, dict):
+                raise TypeError("公式必须是一个json对象")
+            kind = _load_formula(dictionary)
+        except (ValueError, KeyError, TypeError, AttributeError) as error:    #这一行有问题
+            if onerror is not None:
+                onerror(number, line, error)
+            else:
+                import warnings
+                warnings.warn(
+                    "第 %d 行的公式无法加载: %r" % (number, error),
+                    RuntimeWarning, stacklevel=2
+                )
+            continue
+        yield kind
+
+def _index_json(text):
+    """
+    给 {键: 公式} 形式的json文本建立索引，不构建公式类
+
+    整个文本一次交给 json 解析，逐个查找值的边界并不会更快
+
+    返回:
+        ({键: 公式字典}, {英文名称: 键})
+    """
+    index = loads(text)
+    if not isinstance(index, dict):
+        raise ValueError("公式文件必须是一个json对象")
+    names = {}
+    for key, value in index.items():
+        if isinstance(value, dict) and isinstance(value.get('name'), str):
+            names.setdefault(value['name'], key)
+    return index, names
+
+
+class Graphical_library(object):
+    """
+    公式库，按需加载json文件里的公式
+
+    创建时不读取文件，第一次查找时才读取并解析整个文件(和 json.load 一样)，
+    每个公式在第一次查找时才构建成公式类，之后从缓存里取出
+
+    参数:
+        path (str) json文件路径，文件格式和 graphical.json 一样
+        encoding (str) 文件编码
+
+    示例:
+    library = Graphical_library("graphical.json")
+    library["正方形面积"](a=2)()  # 4
+    library["square_area"](a=2)()  # 4，也可以用英文名称查找
+    """
+
+    def __init__(self, path, encoding="utf-8"):
+        self.path = path
+        self.encoding = encoding
+        self._index = None    #键 -> 公式字典
+        self._names = None    #英文名称 -> 键
+        self._classes = {}    #键 -> 已经构建的公式类
+        self._by_name = {}    #英文名称 -> 已经构建的公式类，构建依赖它们的公式时使用
+        self._loading = []    #正在构建的公式，用于发现循环依赖
+        self._lock = threading.RLock()
+
+    def _load_index(self):
+        #建立索引，只会进行一次
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    with open(self.path, encoding=self.encoding) as file:
+                        text = file.read()
+                    self._index, self._names = _index_json(text)
+        return self._index
+
+    def _resolve(self, key):
+        #把英文名称转为键
+        index = self._load_index()
+        if key in index:
+            return key
+        return self._names.get(key)
+
+    def __getitem__(self, key):
+        """通过键或者英文名称获取公式类"""
+        resolved = self._resolve(key)
+        if resolved is None:
+            raise KeyError(key)
+        kind = self._classes.get(resolved)
+        if kind is not None:
+            return kind
+        with self._lock:
+            kind = self._classes.get(resolved)
+            if kind is None:
+                kind = self._store(resolved, self._materialize(resolved))
+        return kind
+
+    def _store(self, key, kind):
+        #保存构建好的公式类
+        self._classes[key] = kind
+        self._by_name[kind.__name__] = kind
+        return kind
+
+    def _materialize(self, key):
+        #构建公式类，公式里引用的库中其他公式先构建
+        if key in self._loading:
+            path = self._loading[self._loading.index(key):] + [key]
+            raise TypeError("公式之间存在循环依赖: " + " -> ".join(path))
+        dictionary = self._index[key]
+        self._loading.append(key)
+        try:
+            try:
+                tree = ast.parse(dictionary['formula'], mode="eval")
+            except SyntaxError:    #比如文章，交给公式类处理
+                tree = None
+            if tree is not None:
+                params = set(dictionary['args'].values())
+                for node in ast.walk(tree):
+                    if isinstance(node, ast.Name) and node.id not in params:
+                        dependency = self._names.get(node.id)
+                        if dependency is not None and dependency != key and dependency not in self._classes:
+                            self._store(dependency, self._materialize(dependency))
+                        elif dependency == key:
+                            raise TypeError("公式之间存在循环依赖: %s -> %s" % (key, key))
+            return _load_formula(dictionary, self._by_name)    #依赖的公式从这个库里找
+        finally:
+            self._loading.pop()
+
+    def get(self, key, default=None):
+        """获取公式类，找不到时返回 default"""
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return self._resolve(key) is not None
+
+    def __iter__(self):
+        return iter(self._load_index())
+
+    def __len__(self):
+        return len(self._load_index())
+
+    def keys(self):
+        """所有的键"""
+        return self._load_index().keys()
+
+    def names(self):
+        """所有的英文名称"""
+        self._load_index()
+        return self._names.keys()
+
+    def loaded(self):
+        """已经构建的公式类 {键: 类}"""
+        return dict(self._classes)
+
+_BUNDLE_MAGIC = b"GRPB"    #公式包文件的标识
+_BUNDLE_VERSION = 2    #公式包格式的版本
+#文件头: 标识, 格式版本, Python 字节码版本, 公式数量, 索引位置, 名称表位置
+_bundle_header = struct.Struct("<4sH2x4sIQQ")
+#索引: 内容哈希, 记录哈希(包括字节码), 记录位置, 记录长度，按内容哈希排序
+_bundle_entry = struct.Struct("<32s32sQI")
+
+def _formula_digest(dictionary):
+    """公式的内容哈希，由名称、公式和参数决定"""
+    text = dumps(
+        {'name': dictionary['name'], 'formula': dictionary['formula'], 'args': dictionary['args']},
+        ensure_ascii=False, sort_keys=True
+    )
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+def buildtoBundle(kinds, file):
+    """
+    把公式类保存成二进制公式包，包含编译好的字节码
+
+    参数:
+        kinds (iterable) 公式类
+        file (str or file) 文件路径，或者以二进制模式打开的文件对象
+
+    返回:
+        写入的字节数
+
+    示例:
+    buildtoBundle([square_area, rectangle_area], "formulas.bundle")
+    """
+    records = []
+    for kind in dict.fromkeys(kinds):
+        if getattr(kind, "extension", None):    #和 buildtoJSON 一样不能保存扩展
+            raise TypeError("'%s' 的扩展不能保存" % kind.__name__)
+        if getattr(kind, "_source", None) is None:    #文章或者写错的公式
+            raise TypeError("'%s' 不能保存成公式包" % kind.__name__)
+        dictionary = {'name': kind.__name__, 'formula': kind.formula, 'args': dict(kind._args.items())}
+        record = marshal.dumps((
+            dictionary['name'], dictionary['formula'], tuple(kind._args.items()),
+            tuple(dep.__name__ for dep in kind._deps),    #依赖的公式
+            kind._source, compile_cache.get(kind._source, _compile_equation)
+        ))
+        records.append((_formula_digest(dictionary), dictionary['name'], record))
+
+    position = _bundle_header.size
+    entries = []
+    for digest, name, record in records:
+        entries.append((digest, hashlib.sha256(record).digest(), position, len(record)))
+        position += len(record)
+    entries.sort()
+    index_offset = position
+    names = marshal.dumps({name: digest for digest, name, record in records})
+    names_offset = index_offset + _bundle_entry.size * len(entries)
+
+    data = [_bundle_header.pack(
+        _BUNDLE_MAGIC, _BUNDLE_VERSION, importlib.util.MAGIC_NUMBER,
+        len(entries), index_offset, names_offset
+    )]
+    data.extend(record for digest, name, record in records)
+    data.extend(_bundle_entry.pack(*entry) for entry in entries)
+    data.append(names)
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, "wb") as stream:
+            stream.writelines(data)
+    else:
+        file.writelines(data)
+    return names_offset + len(names)
+
+def loadfromBundle(path):
+    """
+    打开二进制公式包
+
+    参数:
+        path (str) buildtoBundle 生成的文件路径
+
+    返回:
+        一个 Graphical_bundle 对象
+    """
+    return Graphical_bundle(path)
+
+
+class Graphical_bundle(object):
+    """
+    二进制公式包，用 mmap 打开，按需构建公式类
+
+    通过内容哈希(bytes 或十六进制字符串)或者英文名称查找，
+    记录的哈希(包括字节码)在构建时校验；
+    字节码和当前 Python 版本一致时直接绑定到公式类上，不再解析和编译，
+    也不放入 compile_cache
+
+    参数:
+        path (str) buildtoBundle 生成的文件路径
+
+    示例:
+    with loadfromBundle("formulas.bundle") as bundle:
+        bundle["square_area"](a=2)()  # 4
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if len(self._map) < _bundle_header.size:
+                raise ValueError("'%s' 不是公式包" % path)
+            magic, version, python_magic, count, index_offset, names_offset = \
+                _bundle_header.unpack_from(self._map, 0)
+            if magic != _BUNDLE_MAGIC:
+                raise ValueError("'%s' 不是公式包" % path)
+            if version != _BUNDLE_VERSION:
+                raise ValueError("不支持的公式包版本: %d" % version)
+        except ValueError:
+            self._map.close()
+            raise
+        #字节码版本不同时不使用字节码，从公式重新编译
+        self.compatible = python_magic == importlib.util.MAGIC_NUMBER
+        self._count = count
+        self._index_offset = index_offset
+        self._names_offset = names_offset
+        self._names = None    #英文名称 -> 哈希，第一次按名称查找时读取
+        self._classes = {}    #哈希 -> 已经构建的公式类
+        self._lock = threading.RLock()
+
+    def _find(self, digest):
+        #在按哈希排序的索引里二分查找，返回 (记录哈希, 位置, 长度)
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            entry = _bundle_entry.unpack_from(self._map, self._index_offset + middle * _bundle_entry.size)
+            if entry[0] < digest:
+                low = middle + 1
+            elif entry[0] > digest:
+                high = middle
+            else:
+                return entry[1:]
+        return None
+
+    def _digest(self, key):
+        #把名称或十六进制哈希转为哈希
+        if isinstance(key, (bytes, bytearray)):
+            return bytes(key)
+        if len(key) == 64:
+            try:
+                return bytes.fromhex(key)
+            except ValueError:
+                pass
+        if self._names is None:
+            self._names = marshal.loads(self._map[self._names_offset:])
+        return self._names.get(key)
+
+    def __getitem__(self, key):
+        """通过内容哈希或英文名称获取公式类"""
+        digest = self._digest(key)
+        kind = self._classes.get(digest)
+        if kind is not None:
+            return kind
+        with self._lock:
+            kind = self._classes.get(digest)
+            if kind is None:
+                location = self._find(digest) if digest is not None else None
+                if location is None:
+                    raise KeyError(key)
+                kind = self._classes[digest] = self._materialize(digest, *location)
+        return kind
+
+    def _materialize(self, digest, record_digest, position, length):
+        #校验记录，先构建依赖的公式，再用保存的字节码构建公式类
+        record = self._map[position:position + length]
+        if hashlib.sha256(record).digest() != record_digest:
+            raise ValueError("'%s' 的记录已损坏" % self.path)
+        name, formula, args, deps, source, code = marshal.loads(record)
+        dictionary = {'name': name, 'formula': formula, 'args': dict(args)}
+        if _formula_digest(dictionary) != digest:
+            raise ValueError("'%s' 的记录已损坏" % self.path)
+        namespace = {}    #依赖的公式从这个包里找
+        for dep in deps:
+            if self._digest(dep) is not None:
+                namespace[dep] = self[dep]
+        if not self.compatible:    #字节码版本不同，重新编译
+            dictionary['depends'] = list(deps)
+            return _load_formula(dictionary, namespace)
+        return Graphical_metaclass(name, (Graphical,), {
+            "formula": formula, "args": dictionary['args'],
+            "_namespace": namespace, "_register": False, "_precompiled": (deps, source, code)
+        })
+
+    def get(self, key, default=None):
+        """获取公式类，找不到时返回 default"""
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        digest = self._digest(key)
+        return digest is not None and self._find(digest) is not None
+
+    def __len__(self):
+        return self._count
+
+    def names(self):
+        """所有的英文名称"""
+        self._digest("")
+        return self._names.keys()
+
+    def close(self):
+        """关闭文件，已经构建的公式类仍然可以使用"""
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+_parallel_formulas = {}    #进程池的每个工作进程里构建好的公式类，定义的位置 -> 类
+#按值发送的公式类需要保留的类属性
+_parallel_options = ("lazy", "compact", "memoize", "memoize_maxsize", "memoize_ttl")
+
+def _importable(kind):
+    """类能否按模块名和限定名导入，能导入的类按引用发送到其他进程"""
+    value = sys.modules.get(kind.__module__)
+    for name in kind.__qualname__.split("."):
+        value = getattr(value, name, None)
+    return value is kind
+
+def _parallel_definition(kind, deps):
+    """不能导入的公式类按值发送: (None, 保存字典, 是否是文章, 类属性, 依赖的定义位置)"""
+    base = Graphical_str_compose if issubclass(kind, Graphical_str_compose) else Graphical
+    for klass in kind.__mro__[:kind.__mro__.index(base)]:    #重写的方法无法重新构建
+        for name, value in vars(klass).items():
+            if isinstance(value, (type(_importable), classmethod)):
+                raise TypeError("'%s' 不能发送到其他进程: 重写了 %s，请在模块顶层定义这个类" % (kind.__name__, name))
+    try:
+        dictionary = kind._to_dict()
+    except Warning as error:
+        raise TypeError("'%s' 不能发送到其他进程: %s" % (kind.__name__, error)) from None
+    compose = base is Graphical_str_compose
+    options = {} if compose else {key: getattr(kind, key) for key in _parallel_options}
+    return (None, dictionary, compose, options, deps)
+
+def _parallel_init():
+    """工作进程的初始化函数，清空从父进程复制来的公式类"""
+    _parallel_formulas.clear()
+
+def _parallel_load(definitions):
+    """构建这个工作进程还没有的公式类，每个进程只构建一次
+
+    definitions 是 定义的位置 -> 定义，依赖的公式位置更小，先构建"""
+    for position in sorted(definitions):
+        if position in _parallel_formulas:
+            continue
+        definition = definitions[position]
+        if definition[0] is not None:    #按引用发送的类，反序列化时已经导入
+            _parallel_formulas[position] = definition[0]
+            continue
+        none, dictionary, compose, options, deps = definition
+        if compose:    #文章
+            _parallel_formulas[position] = Graphical_metaclass(dictionary['name'], (Graphical_str_compose,), {
+                "formula": dictionary['formula'], "args": dictionary['args'], "_register": False
+            })
+        else:
+            #依赖的公式按位置找，同名的公式不会混淆
+            namespace = {_parallel_formulas[index].__name__: _parallel_formulas[index] for index in deps}
+            _parallel_formulas[position] = _load_formula(dictionary, namespace, options)
+
+def _evaluate_chunk(jobs):
+    """计算一批 (公式类, 参数字典) 任务，返回 [(是否成功, 结果或者错误), ...]"""
+    results = []
+    for kind, kwargs in jobs:
+        try:
+            results.append((True, kind(**kwargs)()))
+        except Exception as error:    #把错误带回调用的地方
+            results.append((False, error))
+    return results
+
+def _parallel_run(definitions, chunk):
+    """在工作进程里计算一批任务，先构建这批任务用到的公式类"""
+    _parallel_load(definitions)
+    return _evaluate_chunk([(_parallel_formulas[index], kwargs) for index, kwargs in chunk])
+
+def evaluate_parallel(jobs, max_workers=None, chunk_size=256, return_exceptions=False):
+    """
+    用多个进程批量计算公式
+
+    任务按 chunk_size 分批读取和发送，最多 max_workers*2 批同时在计算，
+    内存占用和批的大小有关，和任务的总数无关；
+    每批任务带着用到的公式定义，工作进程只在第一次遇到时构建公式类
+
+    参数:
+        jobs (iterable) (公式类, 参数字典) 组成的任务
+        max_workers (int) 进程数量，默认是 CPU 数量
+        chunk_size (int) 每批任务的数量
+        return_exceptions (bool) 为 True 时出错的任务返回错误对象，
+                                 否则引发第一个出错的任务的错误
+
+    返回:
+        结果列表，顺序和任务一致
+
+    注意:
+        能按模块名导入的公式类直接发送引用；
+        其他的类(比如函数里定义的或者从json加载的)会重新构建，
+        扩展只能是常量或 math 模块的函数，也不能重写方法
+
+    示例:
+    evaluate_parallel([(square_area, {"a": 2}), (rectangle_area, {"a": 2, "b": 3})])  # [4, 6]
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size 必须大于 0")
+    definitions = []    #发送给工作进程的公式定义
+    indexes = {}    #公式类 -> 在定义中的位置
+    needs = []    #每个定义构建时需要的定义位置，包括它自己和依赖的公式
+
+    def ship(kind):
+        #能导入的类按引用发送，保留子类重写的方法和类属性；
+        #其他的类按值发送，依赖的公式先发送
+        if kind in indexes:
+            return indexes[kind]
+        if _importable(kind):
+            definitions.append((kind,))
+            needs.append({len(definitions) - 1})
+        else:
+            deps = tuple(ship(dep) for dep in getattr(kind, "_deps", ()))
+            definitions.append(_parallel_definition(kind, deps))
+            needs.append({len(definitions) - 1}.union(*(needs[dep] for dep in deps)))
+        indexes[kind] = len(definitions) - 1
+        return indexes[kind]
+
+    def payloads():
+        #边读取任务边分批，每批带上用到的公式定义
+        for chunk in _chunked(jobs, chunk_size):
+            chunk = [(ship(kind), kwargs) for kind, kwargs in chunk]
+            used = set().union(*(needs[index] for index in {index for index, kwargs in chunk}))
+            yield {index: definitions[index] for index in used}, chunk
+
+    payloads = payloads()
+    max_workers = max_workers or os.cpu_count() or 1
+    first = list(islice(payloads, max_workers))    #任务不多时不启动多余的进程
+    if not first:
+        return []
+
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor
+    results = []
+    pending = deque()    #按顺序排队的批，最多 max_workers*2 个
+    with ProcessPoolExecutor(max_workers=min(max_workers, len(first)), initializer=_parallel_init) as executor:
+        try:
+            for payload in chain(first, payloads):
+                pending.append(executor.submit(_parallel_run, *payload))
+                while len(pending) >= max_workers * 2 or (pending and pending[0].done()):
+                    _parallel_collect(pending.popleft(), results, return_exceptions)
+            while pending:
+                _parallel_collect(pending.popleft(), results, return_exceptions)
+        finally:
+            for future in pending:    #出错时不再计算剩下的批
+                future.cancel()
+    return results
+
+def _parallel_collect(future, results, return_exceptions):
+    #取出一批的结果，按顺序放进 results
+    for ok, value in future.result():
+        if not ok and not return_exceptions:
+            raise value
+        results.append(value)
+
+
+async def _async_chunks(jobs, chunk_size):
+    #把普通的或者异步的可迭代对象分成一批一批
+    if not hasattr(jobs, "__aiter__"):
+        async def iterate(jobs=jobs):
+            for job in jobs:
+                yield job
+        jobs = iterate()
+        close = jobs.aclose    #提前结束时关闭自己创建的生成器
+    else:
+        close = None
+    chunk = []
+    try:
+        async for job in jobs:
+            chunk.append(job)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    finally:
+        if close is not None:
+            await close()
+
+async def evaluate_stream(jobs, executor=None, chunk_size=256, max_concurrency=4, return_exceptions=False):
+    """
+    异步计算公式，逐个生成结果
+
+    任务按 chunk_size 分批放到 executor 里计算，不阻塞事件循环；
+    最多 max_concurrency 批同时在计算或者等待取走，
+    结果没有被取走时不再读取新的任务
 
-    提示: 注解的用法是标记类型，但Python不会去检查它"""
-    def __init__(self,**kwargs):
-        """初始化图形"""
-        self.kwargs = kwargs    #保存参数
-        self.model = {}    #初始化映射表
-        if getattr(self, '__annotations__', None) is None:    #判断是否有注解
-            self.__annotations__ = {}    #如果没有设定为空值，免得报错
-        for name, func in self.__annotations__.items():    #遍历注解字典
-            #判断是否是公式对象
-            assert issubclass(func, Graphical) ,\
-                '\'%s\' 不是公式对象 (他是 \'%s\')'%(name,func)    #不是报错
-            self.model[name] = func    #将键和值放入映射表
+    参数:
+        jobs (iterable) (公式类, 参数字典) 组成的任务，也可以是异步可迭代对象
+        executor (Executor) 计算用的线程池，默认是事件循环的默认线程池
+        chunk_size (int) 每批任务的数量
+        max_concurrency (int) 同时计算的批数
+        return_exceptions (bool) 为 True 时出错的任务生成错误对象，否则引发错误
 
-    def getresult(self,name):
-        """这里是为了兼容之前的代码而设置的"""
-        #附带参数name为参数名称
-        #通过这里可以更灵活的计算
-        #由于这里被更好用的注解代替
-        #所以这里被用来报错
-        raise AttributeError('\'%s\' object has no attribute \'%s\'' % (self.__class__.__name__, name))
-    
-    def __getattr__(self, name):
-        """可以用xxx.x的方式获取结果"""
-        if name in self.model:    #判断目标是否在映射表里
-            func = self.model[name]    #如果在，取出来
-            return func(**self.kwargs)    #计算返回
-        function = getattr(self,'getresult', None)    #获取报错方法
-        return function(name)    #返回，如果重写了这个就不会直接报错
-    
-    def __call__(self,variable):
-        """也可以用xxx("x")的方式获取结果"""
-        if variable in self.model:    #判断函数是否在映射表里
-            func = self.model[variable]    #如果在，获取键值
-            return func(**self.kwargs)    #返回计算结果
-        return self.getresult(variable)    #返回报错函数
-    
-    def __getitem__(self, key):
-        """还可以通过xxx['x']的方法获取结果"""
-        if self.model.get(key, None) is None:    #判断函数是否在映射表里
-            #如果不在
-            return self.getresult()    #返回报错函数
-        else:    #如果在
-            obj = self.model.get(key)    #获取键值
-            return obj(**self.kwargs)._value    #返回计算结果
+    返回:
+        一个异步生成器，结果顺序和任务一致
 
+    示例:
+    async for result in evaluate_stream((square_area, {"a": a}) for a in range(100)):
+        print(result)
+    """
+    if chunk_size < 1 or max_concurrency < 1:
+        raise ValueError("chunk_size 和 max_concurrency 必须大于 0")
+    import asyncio
+    loop = asyncio.get_running_loop()
+    #提交之前先取得名额，结果全部取走后才归还，形成背压
+    semaphore = asyncio.Semaphore(max_concurrency)
+    queue = asyncio.Queue()    #批数已经由 semaphore 限制，放入时不会等待
+
+    async def produce():
+        chunks = _async_chunks(jobs, chunk_size)
+        try:
+            async for chunk in chunks:
+                await semaphore.acquire()
+                queue.put_nowait(loop.run_in_executor(executor, _evaluate_chunk, chunk))
+        finally:
+            queue.put_nowait(None)    #结束标记
+            await chunks.aclose()    #被取消时也关闭，不交给事件循环回收
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        while True:
+            future = await queue.get()
+            if future is None:
+                break
+            for ok, value in await future:
+                if not ok and not return_exceptions:
+                    raise value
+                yield value
+            semaphore.release()
+        await producer    #读取任务时出错在这里引发
+    finally:
+        producer.cancel()
+        try:
+            await producer    #等待读取任务的协程结束，不留下挂起的任务
+        except asyncio.CancelledError:
+            pass
+        except Exception:    #已经在引发其他错误
+            pass
+        while not queue.empty():    #还没有开始的批不再计算
+            future = queue.get_nowait()
+            if future is not None:
+                future.cancel()
 
-def loadfromJSON(json):
+async def evaluate_async(jobs, executor=None, chunk_size=256, max_concurrency=4, return_exceptions=False):
     """
-    加载json公式
+    异步批量计算公式，参数和 evaluate_stream 一样
 
-    参数:
-        json (str) JSON字符串
-    
     返回:
-        一个公式类对象
+        结果列表，顺序和任务一致
+
+    示例:
+    results = await evaluate_async([(square_area, {"a": 2}), (rectangle_area, {"a": 2, "b": 3})])
     """
-    dictionary = loads(json)    #解析json
-    name = dictionary['name']
-    bases = (Graphical,)
-    classdict = {
-        "formula":dictionary['formula'],
-        "args":dictionary['args']
-    }
-    kind = Graphical_metaclass(name, bases, classdict)    #构建类
-    return kind    #返回类
+    return [
+        value async for value in evaluate_stream(
+            jobs, executor, chunk_size, max_concurrency, return_exceptions
+        )
+    ]
+
 
 #以下是一些图形简单公式
 
@@ -730,19 +2589,6 @@ class cube(Integrated_Graphical):
 #由于Python浮点数运算不精确，所以使用Decimal
 pai = Decimal("3.14")    #圆周率，一般只要精确到小数点后两位就好了
 
-#惰性求值是专门为圆形设计的
-class _lazy_property(object):
-    """惰性求值 描述符"""
-    def __init__(self,fget):
-        self.fun = fget    #初始化
-    
-    def __get__(self, instance, owner):
-        if instance is None:    #如果是类调用
-            return self    #返回本身
-        value = self.fun(instance)    #计算结果
-        setattr(instance,self.fun.__name__, value)    #存放结果
-        return value    #返回结果
-
 #这个是最难的
 class circle_perimeter(Graphical):
     """圆形周长 
@@ -866,16 +2712,101 @@ class Graphical_str_compose(Graphical):
     def __init__(self, **kwargs):
         self.kwargs = kwargs
         self.replace()
+
+    @classmethod
+    def _compile(cls, namespace=None):
+        """把文章编译成文字片段和参数位置，每个类只编译一次
+
+        所有参数名一次匹配，较长的参数名优先，
+        替换进去的值不会再被替换"""
+        cls._params = tuple(cls._args.keys())    #传入的参数名
+        owner = {}    #公式里的参数名 -> 传入的参数名
+        for key, value in cls._args.items():
+            if str(value):
+                owner.setdefault(str(value), key)
+        formula = cls.formula
+        segments = []    #文字片段，参数的位置是 None
+        holes = []    #(片段位置, 传入的参数名)
+        position = 0
+        if owner:
+            pattern = re.compile("|".join(
+                re.escape(name) for name in sorted(owner, key=len, reverse=True)
+            ))
+            for match in pattern.finditer(formula):
+                if match.start() > position:
+                    segments.append(formula[position:match.start()])
+                holes.append((len(segments), owner[match.group()]))
+                segments.append(None)
+                position = match.end()
+        if position < len(formula):
+            segments.append(formula[position:])
+        cls._segments = tuple(segments)
+        cls._holes = tuple(holes)
+
+    @classmethod
+    def _render(cls, kwargs):
+        """把参数填入文章，只拼接一次"""
+        values = {}
+        for key in cls._params:
+            if key not in kwargs:    #必要的参数没有传入
+                raise KeyError(key + " is not given")    #引发错误并详细说明
+            values[key] = str(kwargs[key])
+        parts = list(cls._segments)
+        for index, key in cls._holes:
+            parts[index] = values[key]
+        return "".join(parts)
     
     def replace(self):
-        self._formula = self.formula
-        key = None
-        try:
-            for key,value in self._args.items():    #迭代参数字典，将参数替换到公式里
-                self._formula = self._formula.replace(str(value),str(self.kwargs[key]))
-        except KeyError as error:    #如果引发KeyError,说明必要的参数没有传入
-            raise KeyError(key + " is not given") from error    #引发错误并详细说明
-        #这里再次引发错误是因为原本的错误说明不详细
+        self._formula = self._render(self.kwargs)    #将参数替换到公式里
+
+    @classmethod
+    def render_many(cls, rows):
+        """
+        批量生成文章，不创建公式对象
+
+        参数:
+            rows (iterable) 每行一个参数字典，比如 csv.DictReader
+
+        返回:
+            一个生成器，逐个生成文章
+
+        示例:
+        for text in Marketing.render_many([{"keyword": "我", "incident": "睡觉", "another": "我困啦"}]):
+            print(text)
+        """
+        render = cls._render
+        for row in rows:
+            yield render(row)
+
+    @classmethod
+    def write_many(cls, rows, file, chunk_size=1024, sep="\n"):
+        """
+        批量生成文章并写入文件，每 chunk_size 篇写入一次
+
+        参数:
+            rows (iterable) 每行一个参数字典
+            file (file) 文件对象，需要有 write 方法
+            chunk_size (int) 每次写入的文章数量
+            sep (str) 每篇文章后面添加的分隔符
+
+        返回:
+            写入的文章数量
+        """
+        if chunk_size < 1:
+            raise ValueError("chunk_size 必须大于 0")
+        count = 0
+        chunk = []
+        for text in cls.render_many(rows):
+            chunk.append(text)
+            chunk.append(sep)
+            if len(chunk) >= chunk_size * 2:    #攒够一批再写入
+                file.write("".join(chunk))
+                count += len(chunk) // 2
+                chunk.clear()
+        if chunk:
+            file.write("".join(chunk))
+            count += len(chunk) // 2
+        return count
     
     @_lazy_property   #惰性求值
     def str_formula(self):
@@ -935,8 +2866,8 @@ if _Plugin:
                 """计算"""
                 self.frac = _Fraction(self.formula)    #替换分数表达式
                 if hasattr(self,"extension"):    #有扩展
-                    self.extension["Fraction"] = fractions.Fraction
-                    return compute(self.frac.__str__(),**self.extension)
+                    #复制一份再加入分数，不修改类共用的扩展
+                    return compute(self.frac.__str__(),**dict(self.extension,Fraction=fractions.Fraction))
                 #无扩展
                 return compute(self.frac.__str__(),Fraction=fractions.Fraction)
 
@@ -1156,6 +3087,14 @@ def _test(old_test=False):
             self.assertEqual(test2._value, 9)    #测试用例2  
             test3 = square_area(a=4)
             self.assertEqual(test3._value, 16)    #测试用例3  
+            self.assertEqual(square_area(a="1+2")._value, 9)    #测试用例4，文本参数
+            self.assertEqual(square_area(a="-2**3")._value, 64)    #测试用例5
+
+        def test_error(self):    #测试错误
+            with self.assertError(ValueError):    #不会执行参数里的代码
+                square_area(a="__import__('os').getpid()")
+            with self.assertError(ValueError):    #乘方的结果太大
+                square_area(a="9**9**9**9")
 
 
     class Square_PerimeterTest(TestCase):    #正方形周长类测试
@@ -1320,6 +3259,686 @@ def _test(old_test=False):
             test3 = Marketing(keyword="他",incident="皮",another="他无聊")
             self.assertEqual(test3(), result.format(k="他",i="皮",a="他无聊"))    #测试用例3
 
+    class TemplateTest(TestCase):    #文章模板测试
+        def test_output(self):    #测试输出
+            result = Marketing(keyword="i", incident="k", another="ki")()    #替换进去的值不会再被替换
+            self.assertTrue(result.startswith("ik是怎么回事呢？i相信"))    #测试用例1
+            self.assertEqual(result.count("其实就是ki。"), 1)    #测试用例2
+            class greeting(Graphical_str_compose):
+                formula = "name, 你好！这是 named 参数"
+                args = parameter(name="name", named="named")
+            self.assertEqual(greeting(name="小明", named="x")(), "小明, 你好！这是 x 参数")    #测试用例3
+        
+        def test_many(self):    #测试批量生成
+            import io
+            class greeting_many(Graphical_str_compose):
+                formula = "name你好"
+                args = parameter("name")
+            rows = [{"name": str(number)} for number in range(5)]
+            self.assertEqual(list(greeting_many.render_many(rows)), ["%d你好" % number for number in range(5)])    #测试用例1
+            stream = io.StringIO()
+            self.assertEqual(greeting_many.write_many(rows, stream, chunk_size=2), 5)    #测试用例2
+            self.assertEqual(stream.getvalue(), "".join("%d你好\n" % number for number in range(5)))    #测试用例3
+
+        def test_error(self):    #测试错误
+            with self.assertError(KeyError):
+                Marketing(keyword="我")
+
+    class Evaluate_ManyTest(TestCase):    #批量计算测试
+        def test_output(self):    #测试输出
+            result = cuboid_volume.evaluate_many(a=[1, 2, 10], b=[2, 3, 20], h=[3, 4, 30])
+            self.assertEqual(list(result), [6, 24, 6000])    #测试用例1
+            result = square_area.evaluate_many(a=[2, 3])
+            self.assertEqual(list(result), [4, 9])    #测试用例2
+            result = circle_area.evaluate_many(r=[1, 2])
+            self.assertEqual([round(float(value), 2) for value in result], [3.14, 12.56])    #测试用例3
+            result = rectangle_area.evaluate_many(a=[1, 2], b=3)
+            self.assertEqual(list(result), [3, 6])    #测试用例4
+
+        def test_error(self):    #测试每一列的长度不一样
+            with self.assertError(ValueError):    #不会按最短的一列截断
+                cuboid_surface_area.evaluate_many(a=[1, 2, 3], b=[1, 2], h=1)
+            with self.assertError(ValueError):
+                cuboid.evaluate_table({"a": [1, 2, 3], "b": [1, 2], "h": 1})
+
+    class Compute_BatchTest(TestCase):    #批量计算表达式测试
+        def test_output(self):    #测试输出
+            result = compute_batch("(a+b+h)*4", a=[2, 3, 10], b=[3, 4, 20], h=[4, 5, 30])
+            self.assertEqual(list(result), [36.0, 48.0, 240.0])    #测试用例1
+            result = compute_batch("a/b", a=[1, 3], b=2)
+            self.assertEqual(list(result), [0.5, 1.5])    #测试用例2
+            out = array('d', [0.0, 0.0])
+            self.assertTrue(compute_batch("-a**2", out=out, a=[2, 3]) is out)    #测试用例3
+            self.assertEqual(list(out), [-4.0, -9.0])    #测试用例4
+        
+        def test_iterator(self):    #测试生成器
+            result = compute_batch("a*2", a=(number for number in range(3)))
+            self.assertEqual(list(result), [0.0, 2.0, 4.0])    #测试用例1
+            self.assertEqual(list(square_area.evaluate_many(a=(number for number in range(3)))), [0, 1, 4])    #测试用例2
+
+        def test_error(self):    #测试出错，c扩展和 Python 引发一样的错误
+            global _library_name
+            library_name = _library_name
+            _library_name = lambda: "libgraphical.missing"    #一个不存在的文件
+            try:
+                python = _Engine()
+                python.load()
+            finally:
+                _library_name = library_name
+            self.assertEqual(python.evaluate_batch("a", {"a": [1]})[1], _Engine.PYTHON)    #测试用例1
+            for backend in (engine, python):
+                with self.assertError(ZeroDivisionError):
+                    backend.evaluate_batch("a/b", {"a": [1, 2], "b": [1, 0]})
+                with self.assertError(ValueError):    #结果是复数
+                    backend.evaluate_batch("a**0.5", {"a": [4, -1]})
+
+    class LazyTest(TestCase):    #惰性求值测试
+        def test_output(self):    #测试输出
+            class lazy_area(Graphical):
+                formula = "a*b"
+                args = parameter("a", "b")
+                lazy = True
+            test1 = lazy_area(a=2, b=3)
+            self.assertFalse("_value" in vars(test1))    #测试用例1
+            self.assertEqual(test1(), 6)    #测试用例2
+            self.assertTrue("_value" in vars(test1))    #测试用例3
+            self.assertEqual(str(lazy_area(a=3, b=4)), "12")    #测试用例4
+
+    class CompactTest(TestCase):    #紧凑模式测试
+        def test_output(self):    #测试输出
+            class compact_volume(Graphical):
+                formula = "a*b*h"
+                args = parameter("a", "b", "h")
+                compact = True
+            test1 = compact_volume(a=1, b=2, h=3)
+            self.assertFalse(hasattr(test1, "__dict__"))    #测试用例1
+            self.assertEqual(test1(), 6)    #测试用例2
+            self.assertEqual(test1.kwargs, {"a": 1, "b": 2, "h": 3})    #测试用例3
+            self.assertEqual(test1._formula, "1*2*3")    #测试用例4
+            class lazy_compact_volume(compact_volume):
+                formula = "a*b*h"
+                args = parameter("a", "b", "h")
+                lazy = True
+            test2 = lazy_compact_volume(a=2, b=3, h=4)
+            self.assertFalse(hasattr(test2, "__dict__"))    #测试用例5
+            self.assertEqual(test2(), 24)    #测试用例6
+
+    class MemoizeTest(TestCase):    #结果缓存测试
+        def test_output(self):    #测试输出
+            class memoize_area(Graphical):
+                formula = "a*b"
+                args = parameter("a", "b")
+                memoize = True
+                memoize_maxsize = 2
+            self.assertEqual(memoize_area(a=2, b=3)(), 6)    #测试用例1
+            self.assertEqual(memoize_area(a=2, b=3)(), 6)    #测试用例2
+            self.assertEqual(memoize_area.cache_info()[:2], (1, 1))    #测试用例3
+            self.assertEqual(memoize_area(a=2.0, b=3)(), 6.0)    #测试用例4
+            self.assertEqual(memoize_area.cache_info()[1], 2)    #测试用例5
+            memoize_area.cache_clear()
+            self.assertEqual(memoize_area.cache_info(), (0, 0, 2, 0))    #测试用例6
+
+    class Integrated_CacheTest(TestCase):    #组合图形缓存测试
+        def test_output(self):    #测试输出
+            test1 = rectangle(a=2, b=3)
+            self.assertTrue(test1.area is test1.面积)    #测试用例1
+            self.assertTrue(test1.area is test1("area"))    #测试用例2
+            self.assertEqual(test1["perimeter"], 10)    #测试用例3
+            self.assertEqual(len(test1._results), 2)    #测试用例4
+
+    class Evaluate_AllTest(TestCase):    #一次计算所有成员测试
+        def test_output(self):    #测试输出
+            test1 = cuboid(a=2, b=3, h=4).evaluate_all()
+            self.assertEqual(test1["surface_area"], 52)    #测试用例1
+            self.assertEqual(test1["total_length"], 36)    #测试用例2
+            class circle_area_perimeter(Integrated_Graphical):    #带扩展的组合图形
+                area: circle_area
+                perimeter: circle_perimeter
+            test2 = circle_area_perimeter(r=1).as_dict()
+            self.assertEqual(float(test2["area"]), 3.14)    #测试用例3
+            self.assertEqual(float(test2["perimeter"]), 6.28)    #测试用例4
+
+        def test_conditional(self):    #测试条件表达式里的子表达式不会提前计算
+            class fuse_ratio(Graphical):
+                formula = "a/b if b else 0"
+                args = parameter("a", "b")
+            class fuse_ratio_plus(Graphical):
+                formula = "(a/b if b else 0)+1"
+                args = parameter("a", "b")
+            class fuse_doubled(Graphical):
+                formula = "sum(x*2 for x in (a, b))"
+                args = parameter("a", "b")
+            class fuse_doubled_plus(Graphical):
+                formula = "sum(x*2 for x in (a, b))+1"
+                args = parameter("a", "b")
+            class fuse_group(Integrated_Graphical):
+                ratio: fuse_ratio
+                ratio_plus: fuse_ratio_plus
+                doubled: fuse_doubled
+                doubled_plus: fuse_doubled_plus
+            expected = {"ratio": 0, "ratio_plus": 1, "doubled": 2, "doubled_plus": 3}
+            test1 = fuse_group(a=1, b=0)
+            self.assertEqual({name: test1[name] for name in expected}, expected)    #测试用例1
+            self.assertEqual(fuse_group(a=1, b=0).evaluate_all(), expected)    #测试用例2
+            class fuse_doubled_group(Integrated_Graphical):
+                doubled: fuse_doubled
+                doubled_plus: fuse_doubled_plus
+            table = fuse_doubled_group.evaluate_table({"a": [1, 4], "b": [0, 2]})
+            self.assertEqual([list(table["doubled"]), list(table["doubled_plus"])], [[2, 12], [3, 13]])    #测试用例3
+            if _import_numpy() is None:    #NumPy 不能在数组上计算条件表达式
+                table = fuse_group.evaluate_table({"a": [1, 4], "b": [0, 2]})
+                self.assertEqual([list(table[name]) for name in expected], [[0, 2], [1, 3], [2, 12], [3, 13]])    #测试用例4
+
+    class Evaluate_TableTest(TestCase):    #批量计算所有成员测试
+        def test_output(self):    #测试输出
+            test1 = cuboid.evaluate_table({"a": [1, 2], "b": [3, 4], "h": [5, 6]})
+            self.assertEqual(list(test1["surface_area"]), [46, 88])    #测试用例1
+            self.assertEqual(list(test1["total_length"]), [36, 48])    #测试用例2
+            test2 = cuboid.evaluate_table([{"a": 1, "b": 3, "h": 5}, {"a": 2, "b": 4, "h": 6}])
+            self.assertEqual(list(test2["棱长总和"]), [36, 48])    #测试用例3
+            test3 = cuboid.evaluate_table({"a": [1, 2], "b": 3, "h": 5})    #单个值广播到每一行
+            self.assertEqual(list(test3["total_length"]), [36, 40])    #测试用例4
+            test4 = cuboid.evaluate_table(MappingProxyType({"a": [1], "b": [2], "h": [3]}))    #不是 dict 的映射
+            self.assertEqual(list(test4["total_length"]), [24])    #测试用例5
+        
+        def test_error(self):    #测试错误
+            with self.assertError(KeyError):
+                cuboid.evaluate_table([{"a": 1, "b": 3}])
+
+    class DependencyTest(TestCase):    #公式依赖测试
+        def test_output(self):    #测试输出
+            class cube_volume_from_area(Graphical):
+                formula = "square_area*a"
+                args = parameter("a")
+                depends = square_area
+            self.assertEqual(cube_volume_from_area(a=3)(), 27)    #测试用例1
+            class cube_volume_twice(Graphical):
+                formula = "cube_volume_from_area+square_area*a"
+                args = parameter("a")
+                depends = (cube_volume_from_area, square_area)
+            self.assertEqual(cube_volume_twice(a=2)(), 16)    #测试用例2
+            self.assertEqual(list(cube_volume_twice.evaluate_many(a=[1, 2])), [2, 16])    #测试用例3
+            loaded = loadfromJSON(cube_volume_twice.buildtoJSON())
+            self.assertEqual(loaded._deps, (cube_volume_from_area, square_area))    #测试用例4，depends 会保存到json
+            self.assertEqual(loaded(a=2)(), 16)    #测试用例5
+
+        def test_unrelated(self):    #测试同名的类
+            class abs(Graphical):
+                formula = "a*100"
+                args = parameter("a")
+            class dependency_absolute(Graphical):
+                formula = "abs(a)"
+                args = parameter("a")
+            self.assertEqual(dependency_absolute(a=-3)(), 3)    #测试用例1，没有写在 depends 里的类不会替换内置函数
+            class square_area_unlisted(Graphical):
+                formula = "square_area*a"
+                args = parameter("a", "square_area")
+                depends = square_area
+            self.assertEqual(square_area_unlisted(a=2, square_area=5)(), 10)    #测试用例2，参数名不会当作公式
+        
+        def test_cycle(self):    #测试循环依赖
+            with self.assertError(TypeError):
+                class self_reference(Graphical):
+                    formula = "self_reference+1"
+                    args = parameter("a")
+        
+        def test_missing(self):    #测试缺少参数
+            with self.assertError(TypeError):
+                class missing_argument(Graphical):
+                    formula = "rectangle_area*2"
+                    args = parameter("a")
+                    depends = rectangle_area
+            with self.assertError(TypeError):    #测试用例2，依赖的公式不存在
+                loadfromJSON('{"name": "missing_depends", "formula": "a", "args": {"a": "a"}, "depends": ["missing_formula"]}')
+
+    class RegistryTest(TestCase):    #公式注册表测试
+        def test_output(self):    #测试输出
+            import gc
+            loaded = loadfromJSON('{"name": "square_area", "formula": "a*a*2", "args": {"a": "a"}}')
+            self.assertTrue(formula_registry["square_area"] is square_area)    #测试用例1，加载的类不会覆盖内置公式
+            self.assertEqual(loaded(a=3)(), 18)    #测试用例2
+            class registry_temporary(Graphical):
+                formula = "a+1"
+                args = parameter("a")
+            self.assertTrue("registry_temporary" in formula_registry)    #测试用例3
+            del registry_temporary
+            gc.collect()
+            self.assertFalse("registry_temporary" in formula_registry)    #测试用例4，不再使用的类会被移除
+
+    class LibraryTest(TestCase):    #公式库测试
+        def test_output(self):    #测试输出
+            path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "graphical.json")
+            library = Graphical_library(path)
+            self.assertEqual(library.loaded(), {})    #测试用例1，创建时不构建公式
+            self.assertEqual(library["正方形面积"](a=2)(), 4)    #测试用例2
+            self.assertTrue(library["square_area"] is library["正方形面积"])    #测试用例3
+            self.assertEqual(list(library.loaded()), ["正方形面积"])    #测试用例4
+            self.assertTrue("rectangle_area" in library)    #测试用例5
+        
+        def test_error(self):    #测试错误
+            path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "graphical.json")
+            with self.assertError(KeyError):
+                Graphical_library(path)["not_a_formula"]
+
+    class JSONLinesTest(TestCase):    #逐行加载测试
+        def test_output(self):    #测试输出
+            import io
+            lines = io.StringIO(
+                '{"name": "line_area", "formula": "a*b", "args": {"a": "a", "b": "b"}}\n'
+                '\n'
+                'not json\n'
+                '{"name": "line_perimeter", "formula": "(a+b)*2"}\n'
+                '{"name": "line_square", "formula": "a*a", "args": {"a": "a"}}\n'
+            )
+            errors = []
+            kinds = list(loadfromJSONLines(lines, onerror=lambda number, line, error: errors.append(number)))
+            self.assertEqual([kind.__name__ for kind in kinds], ["line_area", "line_square"])    #测试用例1
+            self.assertEqual(errors, [3, 4])    #测试用例2
+            self.assertEqual(kinds[0](a=2, b=3)(), 6)    #测试用例3
+            kinds = list(loadfromJSONLines([b'{"name": "line_cube", "formula": "a*a*a", "args": {"a": "a"}}']))
+            self.assertEqual(kinds[0](a=2)(), 8)    #测试用例4，读取字节
+
+        def test_memory(self):    #测试内存占用
+            import gc, tracemalloc
+            lines = ('{"name": "stream_%d", "formula": "a*b+%d", "args": {"a": "a", "b": "b"}}' % (i, i % 10)
+                     for i in range(2000))
+            size = len(formula_registry)
+            tracemalloc.start()
+            try:
+                for number, kind in enumerate(loadfromJSONLines(lines)):
+                    if number == 200:
+                        gc.collect()
+                        start = tracemalloc.get_traced_memory()[0]
+                del kind
+                gc.collect()
+                growth = tracemalloc.get_traced_memory()[0] - start
+            finally:
+                tracemalloc.stop()
+            self.assertEqual(len(formula_registry), size)    #测试用例1，不注册
+            self.assertTrue(growth < 256 * 1024)    #测试用例2，内存不随行数增长
+
+    class BundleTest(TestCase):    #公式包测试
+        def test_output(self):    #测试输出
+            import tempfile
+            class bundle_volume(Graphical):
+                formula = "square_area*h"
+                args = parameter("a", "h")
+                depends = square_area
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, "formulas.bundle")
+                buildtoBundle([square_area, rectangle_area, bundle_volume], path)
+                with loadfromBundle(path) as bundle:
+                    self.assertEqual(len(bundle), 3)    #测试用例1
+                    self.assertEqual(bundle["bundle_volume"](a=2, h=3)(), 12)    #测试用例2
+                    digest = _formula_digest(loads(rectangle_area.buildtoJSON())).hex()
+                    self.assertEqual(bundle[digest](a=2, b=3)(), 6)    #测试用例3
+                    self.assertTrue(bundle["square_area"] is bundle["square_area"])    #测试用例4
+                    self.assertTrue(bundle["square_area"] is not square_area)    #测试用例5
+                    self.assertTrue(formula_registry["square_area"] is square_area)    #测试用例6，不覆盖内置公式
+                    self.assertEqual(bundle["bundle_volume"]._deps, (bundle["square_area"],))    #测试用例7
+                compile_cache.cache_clear()
+                with loadfromBundle(path) as bundle:
+                    self.assertEqual(bundle["bundle_volume"]._source, bundle_volume._source)    #测试用例8
+                    self.assertFalse(bundle_volume._source in compile_cache._data)    #测试用例9，不放入全局缓存
+                with open(path, "r+b") as file:    #改掉记录里的公式
+                    data = file.read()
+                    file.seek(0)
+                    file.write(data.replace(b"square_area*h", b"square_area*9"))
+                with loadfromBundle(path) as bundle:
+                    with self.assertError(ValueError):    #测试用例10，记录被修改
+                        bundle["bundle_volume"]
+        
+        def test_error(self):    #测试错误
+            with self.assertError(TypeError):
+                import io
+                buildtoBundle([circle_area], io.BytesIO())
+
+    class BuildAllTest(TestCase):    #批量导出测试
+        def test_output(self):    #测试输出
+            import io
+            stream = io.StringIO()
+            count = buildAlltoJSON(stream, [square_area, circle_area])
+            self.assertEqual(count, 2)    #测试用例1
+            data = loads(stream.getvalue())
+            self.assertEqual(list(data), ["square_area", "circle_area"])    #测试用例2
+            self.assertEqual(loadfromJSON(dumps(data["circle_area"]))(r=1)(), Decimal("3.14"))    #测试用例3
+            stream = io.StringIO()
+            buildAlltoJSON(stream, indent=4)
+            self.assertEqual(stream.getvalue(), dumps(loads(stream.getvalue()), ensure_ascii=False, indent=4))    #测试用例4
+
+    class ParallelTest(TestCase):    #多进程批量计算测试
+        def test_output(self):    #测试输出
+            json_formula = loadfromJSON('{"name": "parallel_area", "formula": "a*b", "args": {"a": "a", "b": "b"}}')
+            jobs = [(square_area, {"a": number}) for number in range(10)]
+            jobs += [(json_formula, {"a": number, "b": 2}) for number in range(10)]
+            jobs.append((circle_area, {"r": 1}))
+            results = evaluate_parallel(jobs, max_workers=2, chunk_size=3)
+            self.assertEqual(results[:10], [number * number for number in range(10)])    #测试用例1
+            self.assertEqual(results[10:20], [number * 2 for number in range(10)])    #测试用例2
+            self.assertEqual(results[20], Decimal("3.14"))    #测试用例3
+            self.assertEqual(evaluate_parallel([]), [])    #测试用例4
+
+        def test_classes(self):    #测试子类和同名的类
+            import types
+            module = types.ModuleType("graphical_parallel_test")    #可以按名称导入的模块
+            module.Graphical, module.parameter = Graphical, parameter
+            exec(
+                "class parallel_base(Graphical):\n"
+                "    formula = 'a*b'\n"
+                "    args = parameter('a', 'b')\n"
+                "class parallel_double(parallel_base):\n"
+                "    formula = 'a*b'\n"
+                "    args = parameter('a', 'b')\n"
+                "    compact = True\n"
+                "    def __call__(self):\n"
+                "        return super().__call__() * 2\n",
+                module.__dict__
+            )
+            sys.modules[module.__name__] = module
+            try:
+                results = evaluate_parallel(
+                    [(module.parallel_base, {"a": 2, "b": 3}), (module.parallel_double, {"a": 2, "b": 3})],
+                    max_workers=1
+                )
+            finally:
+                del sys.modules[module.__name__]
+            self.assertEqual(results, [6, 12])    #测试用例1，子类重写的方法仍然有效
+            class parallel_same(Graphical):
+                formula = "a*2"
+                args = parameter("a")
+            class parallel_first(Graphical):
+                formula = "parallel_same+1"
+                args = parameter("a")
+                depends = parallel_same
+            first = parallel_same
+            class parallel_same(Graphical):
+                formula = "a*3"
+                args = parameter("a")
+                memoize = True
+            class parallel_second(Graphical):
+                formula = "parallel_same+1"
+                args = parameter("a")
+                depends = parallel_same
+            jobs = [(parallel_first, {"a": 1}), (parallel_same, {"a": 1}), (parallel_second, {"a": 1}), (first, {"a": 1})]
+            self.assertEqual(evaluate_parallel(jobs, max_workers=1), [3, 3, 4, 2])    #测试用例2，同名的类不混淆
+            self.assertEqual(
+                evaluate_parallel(iter(jobs * 3), max_workers=2, chunk_size=1), [3, 3, 4, 2] * 3
+            )    #测试用例3，公式跟着用到它的批发送到每个进程
+            class parallel_override(Graphical):
+                formula = "a"
+                args = parameter("a")
+                def __call__(self):
+                    return 0
+            with self.assertError(TypeError):    #测试用例4，不能导入的类重写了方法
+                evaluate_parallel([(parallel_override, {"a": 1})])
+        
+        def test_error(self):    #测试错误
+            jobs = [(square_area, {"a": 2}), (square_area, {}), (square_area, {"a": 3})]
+            results = evaluate_parallel(jobs, max_workers=1, return_exceptions=True)
+            self.assertEqual([results[0], type(results[1]), results[2]], [4, KeyError, 9])    #测试用例1
+            with self.assertError(KeyError):
+                evaluate_parallel(jobs, max_workers=1)
+
+    class ThreadTest(TestCase):    #多线程测试
+        def test_output(self):    #测试输出
+            from concurrent.futures import ThreadPoolExecutor
+            def work(number):
+                a, b, h = number % 7 + 1, number % 5 + 1, number % 3 + 1
+                return (
+                    compute("a*b+h", a=a, b=b, h=h),
+                    compute("a/b-h*2", a=a, b=b, h=h),
+                    cuboid(a=a, b=b, h=h)["total_length"],
+                    cuboid(a=a, b=b, h=h).evaluate_all()["表面积"],
+                    circle_area(r=a)(),
+                    Marketing(keyword=a, incident=b, another=h)()[:4],
+                    compute("%d*%d+%d" % (a, b, h)),    #没有参数的算式经过c扩展计算
+                    compute("(%d+%d)*%d-%d**2" % (a, b, h, a)),
+                    engine.evaluate("%d*%d-%d" % (a, b, h))
+                )
+            backend = engine.NATIVE if engine.available() else engine.PYTHON
+            def expected(number):
+                a, b, h = number % 7 + 1, number % 5 + 1, number % 3 + 1
+                return (
+                    a * b + h, a / b - h * 2, (a + b + h) * 4,
+                    (a * b + a * h + b * h) * 2, pai * a ** 2, "%d%d是怎" % (a, b),
+                    a * b + h, (a + b) * h - a ** 2, (a * b - h, backend)
+                )
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                results = list(executor.map(work, range(2000)))
+            self.assertEqual(results, [expected(number) for number in range(2000)])    #测试用例1
+        
+        def test_immutable(self):    #测试公式不可修改
+            with self.assertError(TypeError):
+                circle_area.extension["pi"] = 3
+            with self.assertError(TypeError):
+                square_area._args["a"] = "b"
+
+    class AsyncTest(TestCase):    #异步计算测试
+        def test_output(self):    #测试输出
+            import asyncio
+            async def jobs():    #异步的任务来源
+                for number in range(50):
+                    await asyncio.sleep(0)
+                    yield square_area, {"a": number}
+            async def run():
+                results = await evaluate_async([(rectangle_area, {"a": number, "b": 2}) for number in range(50)], chunk_size=7)
+                streamed = [value async for value in evaluate_stream(jobs(), chunk_size=4, max_concurrency=2)]
+                return results, streamed
+            results, streamed = asyncio.run(run())
+            self.assertEqual(results, [number * 2 for number in range(50)])    #测试用例1
+            self.assertEqual(streamed, [number * number for number in range(50)])    #测试用例2
+
+        def test_concurrency(self):    #测试同时计算的批数
+            import asyncio
+            from concurrent.futures import ThreadPoolExecutor
+            lock = threading.Lock()
+            active = [0, 0]    #正在计算的批数，最多同时计算的批数
+            class async_slow(Graphical):
+                formula = "a"
+                args = parameter("a")
+                def __call__(self):
+                    with lock:
+                        active[0] += 1
+                        active[1] = max(active)
+                    time.sleep(0.005)
+                    with lock:
+                        active[0] -= 1
+                    return super().__call__()
+            async def run(executor):
+                streamed = [value async for value in evaluate_stream(
+                    ((async_slow, {"a": number}) for number in range(40)), executor, chunk_size=1, max_concurrency=2
+                )]
+                peak = active[1]
+                stream = evaluate_stream(((async_slow, {"a": number}) for number in range(40)), executor, chunk_size=1)
+                async for value in stream:    #提前结束
+                    break
+                await stream.aclose()
+                return streamed, peak, len(asyncio.all_tasks())
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                streamed, peak, tasks = asyncio.run(run(executor))
+            self.assertEqual(streamed, list(range(40)))    #测试用例1
+            self.assertTrue(peak <= 2)    #测试用例2，不超过 max_concurrency
+            self.assertEqual(tasks, 1)    #测试用例3，提前结束后没有挂起的任务
+        
+        def test_error(self):    #测试错误
+            import asyncio
+            jobs = [(square_area, {"a": 2}), (square_area, {})]
+            results = asyncio.run(evaluate_async(jobs, return_exceptions=True))
+            self.assertEqual([results[0], type(results[1])], [4, KeyError])    #测试用例1
+            with self.assertError(KeyError):
+                asyncio.run(evaluate_async(jobs))
+
+    class ServerTest(TestCase):    #计算服务测试
+        def test_output(self):    #测试输出
+            import http.client
+            server = Graphical_server(("127.0.0.1", 0), workers=2)
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            try:
+                connection = http.client.HTTPConnection(*server.server_address[:2], timeout=10)    #同一个连接发送多个请求
+                def request(method, path, body=None):
+                    connection.request(method, path, body=None if body is None else dumps(body))
+                    response = connection.getresponse()
+                    return response.status, loads(response.read().decode("utf-8"))
+                self.assertEqual(request("POST", "/evaluate", {"formula": 1, "args": {"a": 3}}), (200, {"result": 9}))    #测试用例1
+                self.assertEqual(request("POST", "/evaluate", [
+                    {"formula": "长方形面积", "args": {"a": 2, "b": 3}},
+                    {"formula": "circle_area", "args": {"r": 1}},
+                    {"formula": "square_area", "args": {}}
+                ])[1]["results"][:2], [{"result": 6}, {"result": "3.14"}])    #测试用例2
+                self.assertEqual(request("POST", "/evaluate", {"formula": "nothing"})[0], 400)    #测试用例3
+                for value in ["__import__('os').getpid()", "2*3", [1], True, None]:    #测试用例4，只接受数字
+                    status, result = request("POST", "/evaluate", {"formula": 1, "args": {"a": value}})
+                    self.assertEqual((status, result["error"][:10]), (400, "ValueError"))
+                self.assertEqual(request("POST", "/evaluate", {"formula": 1, "args": {"a": "1.5"}}), (200, {"result": 2.25}))    #测试用例5
+                status, result = request("POST", "/evaluate", {"formula": 17, "args": {"keyword": "我", "incident": "睡觉", "another": 3}})
+                self.assertEqual((status, result["result"][:4]), (200, "我睡觉是"))    #测试用例6，文章接受文本参数
+                self.assertEqual(request("POST", "/evaluate", {"formula": 17, "args": {"keyword": [1], "incident": "", "another": ""}})[0], 400)    #测试用例7
+                status, metrics = request("GET", "/metrics")
+                self.assertEqual((status, metrics["connections"], metrics["evaluations"]), (200, 1, 13))    #测试用例8
+                connection.close()
+            finally:
+                server.shutdown()
+                server.server_close()
+
+        def test_workers(self):    #测试空闲的长连接不占用工作线程
+            import http.client, socket
+            server = Graphical_server(("127.0.0.1", 0), workers=1, queue_size=1)
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            body = dumps({"formula": 1, "args": {"a": 3}}).encode("utf-8")
+            head = b"POST /evaluate HTTP/1.1\r\nHost: localhost\r\nContent-Length: %d\r\n\r\n" % len(body)
+            def request(connection):
+                connection.request("POST", "/evaluate", body)
+                response = connection.getresponse()
+                return response.status, response.read()
+            try:
+                idle = [http.client.HTTPConnection(*server.server_address[:2], timeout=10) for number in range(3)]
+                self.assertEqual([request(connection)[0] for connection in idle], [200, 200, 200])    #测试用例1
+                connection = http.client.HTTPConnection(*server.server_address[:2], timeout=10)
+                self.assertEqual(request(connection), (200, b'{"result": 9}'))    #测试用例2，空闲的连接不占用工作线程
+                deadline = time.monotonic() + 10
+                slow = socket.create_connection(server.server_address[:2], timeout=10)
+                slow.sendall(head[:20])    #请求只发送了一半，占用唯一的工作线程
+                waiting = socket.create_connection(server.server_address[:2], timeout=10)
+                waiting.sendall(head[:20])    #排队等待工作线程
+                while server.metrics()["busy"] < 2 and time.monotonic() < deadline:
+                    time.sleep(0.01)
+                self.assertEqual(request(http.client.HTTPConnection(*server.server_address[:2], timeout=10))[0], 503)    #测试用例3
+                slow.sendall(head[20:] + body + head + body)    #两个请求一起发送
+                waiting.sendall(head[20:] + body)
+                for client, number in ((slow, 2), (waiting, 1)):
+                    data = b""
+                    while data.count(b'{"result": 9}') < number and time.monotonic() < deadline + 10:
+                        data += client.recv(65536)
+                    self.assertEqual(data.count(b"200 OK"), number)    #测试用例4
+                started = time.monotonic()
+            finally:
+                server.shutdown()
+                server.server_close()
+            self.assertTrue(time.monotonic() - started < 5)    #测试用例5，有空闲的连接时也能立即关闭
+            self.assertEqual(server.metrics()["open"], 0)    #测试用例6
+            slow.close()
+            waiting.close()
+
+    class BatchTest(TestCase):    #批量计算测试
+        def test_output(self):    #测试输出
+            import io
+            rows = io.StringIO("formula,a,b\n1,3,\n长方形面积,2,3\nnothing,1,\n")
+            output = io.StringIO()
+            self.assertEqual(batch(rows, output), 3)    #测试用例1
+            lines = [loads(line) for line in output.getvalue().splitlines()]
+            self.assertEqual(lines[:2], [{"result": 9}, {"result": 6}])    #测试用例2
+            self.assertEqual(list(lines[2]), ["error"])    #测试用例3
+            rows = io.StringIO("".join(
+                dumps({"formula": "square_area", "args": {"a": number}}) + "\n" for number in range(20)
+            ) + "not json\n")
+            output = io.StringIO()
+            batch(rows, output, workers=2, chunk_size=3)
+            lines = [loads(line) for line in output.getvalue().splitlines()]
+            self.assertEqual(lines[:20], [{"result": number * number} for number in range(20)])    #测试用例4，多进程时顺序不变
+            self.assertEqual(list(lines[20]), ["error"])    #测试用例5
+            rows = io.StringIO('{"formula": 1, "args": {"a": "__import__(\'os\').getpid()"}}\n{"formula": 1, "a": "3"}\n')
+            output = io.StringIO()
+            batch(rows, output)
+            lines = [loads(line) for line in output.getvalue().splitlines()]
+            self.assertEqual((lines[0]["error"][:10], lines[1]), ("ValueError", {"result": 9}))    #测试用例6，不会执行参数里的代码
+            rows = io.StringIO("formula,keyword,incident,another\n17,我,睡觉,我困啦\n")    #文章
+            output = io.StringIO()
+            batch(rows, output)
+            self.assertEqual(loads(output.getvalue())["result"][:4], "我睡觉是")    #测试用例7
+            rows = io.StringIO(dumps({"formula": 17, "args": {"keyword": "我", "incident": "睡觉", "another": "我困啦"}}) + "\n")
+            output = io.StringIO()
+            batch(rows, output)
+            self.assertEqual(loads(output.getvalue())["result"], Marketing(keyword="我", incident="睡觉", another="我困啦")())    #测试用例8
+
+        def test_stream(self):    #测试一行一行输入时一行一行输出
+            written = threading.Event()
+            class Source(object):    #像管道一样不能 seek，第二行要等第一行的结果输出后才到达
+                def __init__(self):
+                    self.waited = []
+                def readline(self):
+                    return '{"formula": 1, "a": 2}\n'
+                def __iter__(self):
+                    self.waited.append(written.wait(10))
+                    yield '{"formula": 1, "a": 3}\n'
+            class Output(list):
+                def writelines(self, lines):
+                    self.extend(lines)
+                    written.set()
+                def flush(self):
+                    pass
+            for workers in (1, 2):
+                written.clear()
+                source, output = Source(), Output()
+                self.assertEqual(batch(source, output, workers=workers), 2)    #测试用例1
+                self.assertEqual([loads(line) for line in output], [{"result": 4}, {"result": 9}])    #测试用例2
+                self.assertEqual(source.waited, [True])    #测试用例3，没有等凑满一批
+
+    class EngineTest(TestCase):    #c扩展加载测试
+        def test_missing(self):    #测试找不到动态链接库
+            import warnings
+            global _library_name
+            library_name = _library_name
+            _library_name = lambda: "libgraphical.missing"    #一个不存在的文件
+            try:
+                missing = _Engine()
+                with warnings.catch_warnings(record=True) as caught:
+                    warnings.simplefilter("always")
+                    self.assertEqual(missing.evaluate("1+2"), (3, _Engine.PYTHON))    #测试用例1，没有要求c扩展时不警告
+                    self.assertEqual(len(caught), 0)    #测试用例2
+                    missing.require()
+                    self.assertEqual(len(caught), 1)    #测试用例3，明确要求时才警告
+            finally:
+                _library_name = library_name
+
+    class Compiled_FormulaTest(TestCase):    #公式类编译测试
+        def test_output(self):    #测试输出
+            #以前每个对象把参数替换进公式文本再计算，编译好的公式类结果要一样
+            cases = [
+                (square_area, {"a": 3}), (rectangle_perimeter, {"a": 2, "b": 5}),
+                (triangle_area, {"a": 3, "h": 5}), (trapezoid_area, {"a": 1.5, "b": 2, "h": 4}),
+                (cuboid_surface_area, {"a": 2, "b": 3, "h": 4}), (cube_volume, {"a": 7}),
+                (circle_perimeter, {"r": 2}), (circle_area, {"r": 3}),
+            ]
+            for kind, kwargs in cases:
+                test = kind(**kwargs)
+                if getattr(kind, "extension", None):
+                    expected = compute(test._formula, **kind.extension)
+                else:
+                    expected = compute(test._formula, c_extend=False)
+                self.assertEqual(test(), expected)    #测试用例1
+
+    class Compile_CacheTest(TestCase):    #表达式缓存测试
+        def test_cache(self):    #测试缓存
+            cache = _LRUCache(maxsize=2)
+            self.assertEqual(cache.get("1+1",_compile_equation), cache.get("1+1",_compile_equation))    #测试用例1
+            self.assertEqual(cache.cache_info()[:2], (1, 1))    #测试用例2
+            cache.get("1+2",_compile_equation)
+            cache.get("1+3",_compile_equation)
+            self.assertFalse("1+1" in cache)    #测试用例3
+            self.assertEqual(compute("2*3",c_extend=False), 6)    #测试用例4
+
     tests_list = [    #单元测试列表
         Square_AreaTest,
         Square_PerimeterTest,
@@ -1337,7 +3956,30 @@ def _test(old_test=False):
         Sum_Of_Cuboid_EdgesTest,
         Circle_PerimeterTest,
         Circle_AreaTest,
-        MarketingTest
+        MarketingTest,
+        TemplateTest,
+        Evaluate_ManyTest,
+        Compute_BatchTest,
+        LazyTest,
+        CompactTest,
+        MemoizeTest,
+        Integrated_CacheTest,
+        Evaluate_AllTest,
+        Evaluate_TableTest,
+        DependencyTest,
+        RegistryTest,
+        LibraryTest,
+        JSONLinesTest,
+        BundleTest,
+        BuildAllTest,
+        ParallelTest,
+        ThreadTest,
+        AsyncTest,
+        ServerTest,
+        BatchTest,
+        EngineTest,
+        Compiled_FormulaTest,
+        Compile_CacheTest
     ]
     
     if old_test:    #旧的测试
@@ -1641,6 +4283,55 @@ class formula_enum(Enum):
     圆形面积 = circle_area
     营销号生成器 = Marketing
 
+def buildAlltoJSON(file, formulas=None, indent=None):
+    """
+    把多个公式一次写入JSON文件，格式和 graphical.json 一样
+
+    边生成边写入，不会先构建整个字典；
+    常量扩展(比如圆周率)也会保存，无法保存的公式会发出警告并跳过
+
+    参数:
+        file (file) 以文本模式打开的文件对象，需要有 write 方法
+        formulas (dict or iterable) {键: 公式类} 或者公式类列表(用类名作为键)，
+                                    默认是所有内置公式，用中文名称作为键
+        indent (int) 格式化JSON的缩进，None 时输出紧凑的JSON
+
+    返回:
+        写入的公式数量
+
+    示例:
+    with open("graphical.json", "w", encoding="utf-8") as file:
+        buildAlltoJSON(file, indent=4)
+    """
+    if formulas is None:    #内置公式
+        formulas = {_built_cn_en_table[kind.__name__]: kind for kind in formula_list}
+    elif not isinstance(formulas, dict):
+        formulas = {kind.__name__: kind for kind in formulas}
+    if indent is None:    #紧凑
+        separators = (",", ":")
+        newline = ""
+    else:
+        separators = (",", ": ")
+        newline = "\n" + " " * indent
+    count = 0
+    file.write("{")
+    for key, kind in formulas.items():
+        try:
+            dictionary = kind._to_dict()
+        except (Warning, AttributeError) as error:    #无法保存的扩展，或者不是公式
+            import warnings
+            warnings.warn("公式 %r 无法保存: %s" % (key, error), RuntimeWarning, stacklevel=2)
+            continue
+        entry = dumps(dictionary, ensure_ascii=False, indent=indent, separators=separators)
+        file.write("%s%s%s%s%s" % (
+            "," if count else "", newline,
+            dumps(key, ensure_ascii=False), separators[1],
+            entry.replace("\n", newline) if indent is not None else entry
+        ))
+        count += 1
+    file.write("\n}" if count and indent is not None else "}")
+    return count
+
 def _builtin_formula_to_json(indent=4):
     """
     将内置公式构建成JSON文件
@@ -1650,15 +4341,10 @@ def _builtin_formula_to_json(indent=4):
     返回:
         一个JSON字符串
     """
-    builtin_dict = {}
-    for graphical_formula in formula_list:
-        if hasattr(graphical_formula,"extension"):
-            continue
-        json_data = graphical_formula.buildtoJSON()
-        data = loads(json_data)
-        builtin_dict[_built_cn_en_table[data['name']]] = data
-    json = dumps(builtin_dict,ensure_ascii=False,indent=indent)
-    return json
+    import io
+    stream = io.StringIO()
+    buildAlltoJSON(stream, indent=indent)
+    return stream.getvalue()
 
 
 formula_name = [    #公式的名称
@@ -2109,9 +4795,521 @@ def _run_shell():
         #也就是按下 Ctrl+C
         pass    #跳过
 
+def _find_formula(key, library=None):
+    """
+    根据图形ID、中文名称或者英文名称找到公式类
+
+    参数:
+        key (int or str) 图形ID(从1开始)、中文名称或英文名称
+        library (Graphical_library) 内置公式里找不到时再到公式库里找
+
+    返回:
+        公式类，找不到时引发 KeyError
+    """
+    if isinstance(key, int) or (isinstance(key, str) and key.isdigit()):    #图形ID
+        index = int(key)
+        if 1 <= index <= len(formula_list):
+            return formula_list[index - 1]
+        raise KeyError("不是有效的图形: %s" % key)
+    if key in formula_dict:    #中文名称
+        return formula_dict[key]
+    for kind in formula_list:    #英文名称
+        if kind.__name__ == key:
+            return kind
+    if library is not None and key in library:
+        return library[key]
+    raise KeyError("不是有效的图形: %s" % key)
+
+def _to_jsonable(value):
+    #Decimal 和 Fraction 转为字符串，保留精度
+    if isinstance(value, (Decimal, fractions.Fraction)):
+        return str(value)
+    return value
+
+
+class _Server_handler(BaseHTTPRequestHandler):
+    """处理计算请求
+
+    GET  /formulas  所有内置公式
+    GET  /metrics   运行状态
+    POST /evaluate  {"formula": ID或名称, "args": {...}}，也可以是由它们组成的列表
+    """
+    protocol_version = "HTTP/1.1"    #支持长连接
+    timeout = 10    #读取一个请求最多等待10秒，空闲的长连接不占用工作线程
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def _send(self, status, data):
+        body = dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.server.count("requests")
+        if self.path == "/metrics":
+            self._send(200, self.server.metrics())
+        elif self.path == "/formulas":
+            self._send(200, [
+                {"id": number, "name": kind.__name__, "key": _built_cn_en_table[kind.__name__],
+                 "args": list(kind._args)}
+                for number, kind in enumerate(formula_list, 1)
+            ])
+        else:
+            self.server.count("errors")
+            self._send(404, {"error": "没有这个路径: %s" % self.path})
+
+    def do_POST(self):
+        self.server.count("requests")
+        if self.path != "/evaluate":
+            self.server.count("errors")
+            self._send(404, {"error": "没有这个路径: %s" % self.path})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = loads(self.rfile.read(length).decode("utf-8"))
+        except ValueError as error:    #不是有效的json
+            self.server.count("errors")
+            self._send(400, {"error": "请求不是有效的JSON: %s" % error})
+            return
+        if isinstance(request, list):    #批量请求，每一项单独返回结果或错误
+            self._send(200, {"results": [self._evaluate(item) for item in request]})
+        else:
+            result = self._evaluate(request)
+            self._send(200 if "result" in result else 400, result)
+
+    def _evaluate(self, request):
+        #计算一项，返回 {"result": 结果} 或 {"error": 错误}
+        self.server.count("evaluations")
+        try:
+            if not isinstance(request, dict):
+                raise TypeError("每一项必须是一个JSON对象")
+            kind = _find_formula(request.get("formula"), self.server.library)
+            arguments = _request_arguments(kind, request.get("args") or {})    #先检查参数，再计算
+            return {"result": _to_jsonable(kind(**arguments)())}
+        except Exception as error:    #错误返回给客户端，服务继续运行
+            self.server.count("errors")
+            return {"error": "%s: %s" % (type(error).__name__, error)}
+
+
+class Graphical_server(HTTPServer):
+    """
+    本地HTTP计算服务，公式只编译一次，一直保存在内存里
+
+    每个连接可以发送多个请求(长连接)；空闲的连接由一个线程统一等待，
+    收到请求时才交给固定大小的线程池处理，处理完一个请求就让出工作线程。
+    等待处理的请求超过 queue_size 个时直接返回 503
+
+    参数:
+        address (tuple) (主机, 端口)，端口为 0 时自动选择
+        workers (int) 工作线程数量
+        library (Graphical_library) 额外的公式库
+        verbose (bool) 是否打印访问日志
+        queue_size (int) 最多等待处理的请求数，默认是 workers 的4倍
+
+    示例:
+    server = Graphical_server(("127.0.0.1", 8000))
+    server.serve_forever()
+    """
+    idle_timeout = 30    #空闲的长连接30秒后关闭
+
+    def __init__(self, address=("127.0.0.1", 8000), workers=4, library=None, verbose=False, queue_size=None):
+        HTTPServer.__init__(self, address, _Server_handler)
+        from concurrent.futures import ThreadPoolExecutor
+        self.workers = workers
+        self.queue_size = workers * 4 if queue_size is None else queue_size
+        self.library = library
+        self.verbose = verbose
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="graphical")
+        self._counters = {"requests": 0, "evaluations": 0, "errors": 0, "connections": 0, "rejected": 0}
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._busy = 0    #正在处理和等待处理的请求数
+        self._connections = set()    #所有打开的连接
+        self._idle = []    #等待放入 selector 的连接
+        self._closed = False
+        self._selector = selectors.DefaultSelector()
+        self._wakeup, self._wakeup_writer = socket.socketpair()    #唤醒等待连接的线程
+        self._wakeup.setblocking(False)
+        self._wakeup_writer.setblocking(False)
+        self._selector.register(self._wakeup, selectors.EVENT_READ)
+        self._watcher = threading.Thread(target=self._watch, name="graphical-idle", daemon=True)
+        self._watcher.start()
+
+    def count(self, name, number=1):
+        """增加计数"""
+        with self._lock:
+            self._counters[name] += number
+
+    def metrics(self):
+        """运行状态"""
+        with self._lock:
+            data = dict(self._counters)
+            data["busy"] = self._busy
+            data["open"] = len(self._connections)
+        data["uptime"] = time.monotonic() - self._started
+        data["workers"] = self.workers
+        data["compile_cache"] = compile_cache.cache_info()
+        data["native"] = engine.available()
+        return data
+
+    def process_request(self, request, client_address):
+        #新的连接先放进 selector，收到请求时再交给线程池，不为每个连接创建线程
+        self.count("connections")
+        handler = _Server_handler.__new__(_Server_handler)    #每个连接一个处理对象，读取缓冲区跨请求保留
+        handler.request, handler.client_address, handler.server = request, client_address, self
+        handler.setup()
+        with self._lock:
+            self._connections.add(handler)
+        self._wait(handler)
+
+    def _wait(self, handler):
+        #把空闲的连接交给等待线程
+        with self._lock:
+            self._idle.append(handler)
+        try:
+            self._wakeup_writer.send(b"\0")
+        except OSError:    #已经有唤醒的数据没有读取，或者已经关闭
+            pass
+
+    def _watch(self):
+        #等待空闲的连接收到数据，关闭超时的连接
+        while not self._closed:
+            for key, events in self._selector.select(timeout=1):
+                if key.fileobj is self._wakeup:
+                    try:
+                        self._wakeup.recv(4096)
+                    except OSError:
+                        pass
+                    continue
+                self._selector.unregister(key.fileobj)
+                self._dispatch(key.data[0])
+            now = time.monotonic()
+            with self._lock:
+                idle, self._idle = self._idle, []
+            for handler in idle:
+                self._selector.register(handler.connection, selectors.EVENT_READ, (handler, now))
+            for key in list(self._selector.get_map().values()):
+                if key.data is not None and now - key.data[1] > self.idle_timeout:
+                    self._selector.unregister(key.fileobj)
+                    self._close(key.data[0])
+        for key in list(self._selector.get_map().values()):    #服务关闭了
+            if key.data is not None:
+                self._close(key.data[0])
+        self._selector.close()
+
+    def _dispatch(self, handler):
+        #收到请求，交给线程池；等待处理的请求太多时返回 503
+        with self._lock:
+            full = self._busy >= self.workers + self.queue_size
+            if not full:
+                self._busy += 1
+        if full:
+            self.count("rejected")
+            self._reject(handler)
+            return
+        future = self._executor.submit(self._process, handler)
+        future.add_done_callback(lambda future: future.cancelled() and self._close(handler))
+
+    def _reject(self, handler):
+        #读取已经到达的请求，返回 503 后关闭连接
+        body = dumps({"error": "服务繁忙，请稍后再试"}, ensure_ascii=False).encode("utf-8")
+        connection = handler.connection
+        try:
+            connection.settimeout(0)
+            try:
+                while connection.recv(65536):
+                    pass
+            except OSError:    #没有更多数据
+                pass
+            connection.settimeout(1)
+            connection.sendall(
+                b"HTTP/1.1 503 Service Unavailable\r\n"
+                b"Content-Type: application/json; charset=utf-8\r\n"
+                b"Content-Length: " + str(len(body)).encode("ascii") + b"\r\n"
+                b"Connection: close\r\n\r\n" + body
+            )
+        except OSError:
+            pass
+        self._close(handler)
+
+    def _process(self, handler):
+        #在工作线程里处理请求，缓冲区里还有请求时继续处理，没有时把连接交还等待线程
+        try:
+            while True:
+                handler.handle_one_request()
+                if handler.close_connection or self._closed:
+                    break
+                connection = handler.connection
+                connection.settimeout(0)    #只看已经到达的数据，不等待
+                try:
+                    pending = handler.rfile.peek(1)
+                finally:
+                    connection.settimeout(handler.timeout)
+                if not pending:
+                    self._wait(handler)
+                    return
+        except Exception:
+            self.handle_error(handler.request, handler.client_address)
+        finally:
+            with self._lock:
+                self._busy -= 1
+        self._close(handler)
+
+    def _close(self, handler):
+        #关闭连接，每个连接只关闭一次
+        with self._lock:
+            if handler not in self._connections:
+                return
+            self._connections.discard(handler)
+        try:
+            handler.finish()
+        except OSError:
+            pass
+        self.shutdown_request(handler.request)
+
+    def server_close(self):
+        """关闭服务，空闲的连接直接关闭，正在处理的连接处理完当前请求后关闭"""
+        HTTPServer.server_close(self)
+        self._closed = True
+        try:
+            self._wakeup_writer.send(b"\0")
+        except OSError:
+            pass
+        self._watcher.join()
+        self._wakeup.close()
+        self._wakeup_writer.close()
+        with self._lock:
+            connections = list(self._connections)
+        for handler in connections:    #正在读取请求的工作线程立即返回
+            try:
+                handler.connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+def serve(host="127.0.0.1", port=8000, workers=4, library=None):
+    """启动计算服务，按下 Ctrl+C 停止"""
+    server = Graphical_server((host, port), workers=workers, library=library, verbose=True)
+    print("Graphical 计算服务运行在 http://%s:%d/" % server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:    #按下 Ctrl+C
+        pass
+    finally:
+        server.server_close()
+
+def _batch_rows(source, format=None):
+    """
+    逐行读取批量计算的请求
+
+    参数:
+        source (file) 文本文件对象
+        format (str) "csv" 或 "jsonl"，None 时根据第一行判断
+
+    返回:
+        一个生成器，CSV 每行生成 (公式ID或名称, 参数字典)，这一行有问题时公式是一个错误对象；
+        JSON Lines 直接生成这一行的文本，在计算时再解析，这样多进程时解析也是并行的
+    """
+    first = source.readline()
+    lines = chain([first], source)
+    if format is None:
+        format = "jsonl" if first.lstrip().startswith("{") else "csv"
+    if format == "csv":    #第一行是表头，formula 列是公式，其他列是参数，空的格子忽略
+        for row in csv.DictReader(lines):
+            key = row.pop("formula", None)
+            if key is None:
+                yield ValueError("缺少 formula 列"), None
+                continue
+            yield key, {name: value for name, value in row.items() if name and value not in ("", None)}
+    elif format == "jsonl":    #每行一个 {"formula": ..., "args": {...}}，也可以把参数直接写在里面
+        for line in lines:
+            if line.strip():    #跳过空行
+                yield line
+    else:
+        raise ValueError("不支持的格式: %s" % format)
+
+_batch_library = None    #批量计算的工作进程里的公式库
+
+def _batch_init(library):
+    """批量计算的工作进程的初始化函数"""
+    global _batch_library
+    _batch_library = Graphical_library(library) if library else None
+
+def _parse_json_row(line):
+    """解析一行 JSON Lines 请求，返回 (公式ID或名称, 参数字典)"""
+    request = loads(line)
+    if not isinstance(request, dict):
+        raise ValueError("每行必须是一个JSON对象")
+    key = request.pop("formula", None)
+    return key, request["args"] if isinstance(request.get("args"), dict) else request
+
+def _batch_evaluate(rows, library=None):
+    """计算一批行，返回每行结果的JSON文本
+
+    每行是 (公式, 参数) 或者还没有解析的 JSON Lines 文本"""
+    if library is None:
+        library = _batch_library
+    lines = []
+    for row in rows:
+        try:
+            key, kwargs = _parse_json_row(row) if isinstance(row, str) else row
+            if isinstance(key, Exception):    #读取这一行时就出错了
+                raise key
+            if key is None:
+                raise KeyError("没有指定公式")
+            kind = _find_formula(key, library)
+            result = {"result": _to_jsonable(kind(**_request_arguments(kind, kwargs))())}
+        except Exception as error:    #错误写进结果，继续计算下一行
+            result = {"error": "%s: %s" % (type(error).__name__, error)}
+        lines.append(dumps(result, ensure_ascii=False) + "\n")
+    return lines
+
+def batch(source, output=None, format=None, workers=1, library=None, chunk_size=1024):
+    """
+    批量计算，边读取边计算边输出
+
+    输入是管道或者终端时，已经读到的行不等凑满一批就计算，
+    结果每算完一批就写出，一行一行输入时也是一行一行输出
+
+    参数:
+        source (file) 输入的文本文件对象，CSV 或者 JSON Lines，每行一个公式ID或名称和参数
+        output (file) 输出的文件对象，默认是标准输出，每行一个 {"result": ...} 或 {"error": ...}
+        format (str) "csv" 或 "jsonl"，None 时根据第一行判断
+        workers (int) 进程数量，1 时在当前进程计算
+        library (str) 额外的JSON公式库文件路径
+        chunk_size (int) 每批的行数
+
+    返回:
+        计算的行数
+
+    示例:
+    graphical --batch rows.csv
+    cat rows.jsonl | graphical --batch --workers 4
+    """
+    if output is None:
+        output = sys.stdout
+    rows = _batch_rows(source, format)
+    try:
+        seekable = source.seekable()
+    except (AttributeError, ValueError):
+        seekable = False
+    #普通文件可以一直读下去，凑满一批再计算；管道和终端读到多少算多少
+    chunks = _chunked(rows, chunk_size) if seekable else _available_chunks(rows, chunk_size)
+    count = 0
+    if workers <= 1:    #在当前进程计算
+        library = Graphical_library(library) if library else None
+        for chunk in chunks:
+            output.writelines(_batch_evaluate(chunk, library))
+            output.flush()
+            count += len(chunk)
+        return count
+
+    import queue
+    from concurrent.futures import ProcessPoolExecutor
+    #正在计算的批按顺序交给输出线程，最多 workers*2 个，保持内存不增长；
+    #读取输入时阻塞也不影响输出已经算完的批
+    pending = queue.Queue(maxsize=workers * 2)
+    failed = []    #输出时的错误，比如管道被关闭
+
+    def write():
+        while True:
+            future = pending.get()
+            if future is None:
+                return
+            if failed:    #已经出错，剩下的批只取出不输出
+                continue
+            try:
+                output.writelines(future.result())
+                output.flush()
+            except BaseException as error:
+                failed.append(error)
+
+    writer = threading.Thread(target=write, name="graphical-batch", daemon=True)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_batch_init, initargs=(library,)) as executor:
+        #先启动工作进程再开始读取：读取线程拿着标准输入的锁时创建的子进程，关闭标准输入时会卡住
+        executor.submit(int).result()
+        writer.start()
+        try:
+            for chunk in chunks:
+                if failed:
+                    break
+                pending.put(executor.submit(_batch_evaluate, chunk))
+                count += len(chunk)
+        finally:
+            pending.put(None)
+            writer.join()
+    if failed:
+        raise failed[0]
+    return count
+
+def _chunked(iterable, size):
+    #把可迭代对象分成一批一批的列表
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def _available_chunks(iterable, size):
+    """把可迭代对象分成一批一批的列表，已经读到的行不等凑满一批就交出去
+
+    在单独的线程里读取，读取阻塞时(比如等待标准输入)前面的行已经可以计算"""
+    import queue
+    rows = queue.Queue(maxsize=size * 2)
+    stopped = threading.Event()
+    end = object()    #结束标记
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                rows.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def read():
+        try:
+            for row in iterable:
+                put(row)
+                if stopped.is_set():
+                    return
+        except BaseException as error:    #读取时的错误交给调用的地方
+            put((end, error))
+        else:
+            put((end, None))
+
+    threading.Thread(target=read, name="graphical-reader", daemon=True).start()
+    try:
+        while True:
+            chunk = []
+            row = rows.get()    #至少等到一行
+            while True:
+                if row.__class__ is tuple and row and row[0] is end:
+                    if chunk:
+                        yield chunk
+                    if row[1] is not None:
+                        raise row[1]
+                    return
+                chunk.append(row)
+                if len(chunk) >= size:
+                    break
+                try:
+                    row = rows.get_nowait()
+                except queue.Empty:    #已经读到的行先计算
+                    break
+            yield chunk
+    finally:
+        stopped.set()
+
 #命令行帮助
 HELP = '''
-选项: graphical [-h] [-t | -s | -g | -j | -ot] [-l] [id] [(key value) [(key value) ...]]
+选项: graphical [-h] [-t | -s | -g | -j | -ot | --serve | --batch [PATH]] [-l] [id] [(key value) [(key value) ...]]
 
 选项参数:
   -h, --help       显示帮助并退出
@@ -2120,6 +5318,20 @@ HELP = '''
   -g, --gui        打开图形界面
   -j, --json       将内置公式导出到JSON
   -ot, --old-test  开始旧的测试
+  --serve          启动本地HTTP计算服务
+                   GET /formulas, GET /metrics,
+                   POST /evaluate {"formula": ID或名称, "args": {...}}(可以是列表)
+  --batch [PATH]   批量计算文件(没有 PATH 时读取标准输入)的每一行，
+                   每行输出一个 {"result": ...} 或 {"error": ...}
+                   CSV: 表头里 formula 列是ID或名称，其他列是参数
+                   JSON Lines: {"formula": ID或名称, "args": {...}}
+
+计算服务和批量计算:
+  --host HOST      地址，默认 127.0.0.1
+  --port PORT      端口，默认 8000
+  --workers N      工作线程数量(默认 4)，批量计算时是进程数量(默认 1)
+  --format FORMAT  批量计算的输入格式 csv 或 jsonl，默认根据第一行判断
+  --library PATH   额外的JSON公式库文件
 
   -l, --list       列出所有可用的图形公式
   id               图形ID
@@ -2140,6 +5352,15 @@ def _command(arg):
     option.add_argument("-g","--gui",action="store_true",help="打开图形界面")
     option.add_argument("-j","--json",action="store_true",help="将内置公式导出到JSON")
     option.add_argument("-ot","--old-test",action="store_true",help="开始旧的测试")
+    option.add_argument("--serve",action="store_true",help="启动本地HTTP计算服务")
+    option.add_argument("--batch",nargs="?",const="-",metavar="PATH",help="批量计算文件或者标准输入的每一行")
+
+    server = parse.add_argument_group()    #计算服务和批量计算的选项
+    server.add_argument("--host",default="127.0.0.1",help="计算服务的地址")
+    server.add_argument("--port",type=int,default=8000,help="计算服务的端口")
+    server.add_argument("--workers",type=int,help="工作线程或进程的数量")
+    server.add_argument("--format",choices=("csv","jsonl"),help="批量计算的输入格式")
+    server.add_argument("--library",help="额外的JSON公式库文件")
 
     group = parse.add_argument_group()
     group.add_argument("-l","--list",help="列出所有可用的图形公式",action="store_true") #添加list参数
@@ -2174,6 +5395,23 @@ def _command(arg):
         #老的测试模块
         return _test(old_test=True)    #启动老的测试
 
+    elif parse_args.serve:
+        #计算服务
+        library = Graphical_library(parse_args.library) if parse_args.library else None
+        return serve(parse_args.host, parse_args.port, parse_args.workers or 4, library)
+
+    elif parse_args.batch:
+        #批量计算，"-" 表示标准输入
+        try:
+            if parse_args.batch == "-":
+                return batch(sys.stdin, format=parse_args.format, workers=parse_args.workers or 1, library=parse_args.library)
+            with open(parse_args.batch, encoding="utf-8", newline="") as source:
+                return batch(source, format=parse_args.format, workers=parse_args.workers or 1, library=parse_args.library)
+        except BrokenPipeError:    #输出被关闭，比如 | head，不再输出错误信息
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, sys.stdout.fileno())    #退出时刷新标准输出不会再出错
+            sys.exit(1)
+
     elif parse_args.list:    
         #图形ID列表
         _print_id_key()    #调用函数打印
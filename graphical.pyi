@@ -1,13 +1,64 @@
-def compute(equation: str, **kwargs) -> int or float: ...
+from weakref import WeakValueDictionary
+
+class _LRUCache(object):
+
+    def __init__(self, maxsize: int = 128, ttl: float = None) -> None: ...
+
+    def get(self, key, factory: object) -> object: ...
+
+    def put(self, key, value) -> None: ...
+
+    def resize(self, maxsize: int) -> None: ...
+
+    def cache_info(self) -> tuple: ...
+
+    def cache_clear(self) -> None: ...
+
+compile_cache: _LRUCache
+formula_registry: WeakValueDictionary
+
+class _Engine(object):
+    NATIVE: str
+    PYTHON: str
+
+    def load(self) -> object: ...
+
+    def available(self) -> bool: ...
+
+    def evaluate(self, equation: str, **kwargs) -> tuple: ...
+
+    def evaluate_batch(self, equation: str, columns: dict, out=None) -> tuple: ...
+
+engine: _Engine
+
+def compute(equation: str, c_extend: bool = None, **kwargs) -> int or float: ...
+
+def compute_batch(equation: str, out=None, **columns) -> object: ...
 
 class Graphical_metaclass(type):
     def __new__(cls, name: str, bases: tuple, classdict: dict) -> type: ...
 
 class Graphical(object, metaclass=Graphical_metaclass):
+    lazy: bool
+    compact: bool
+    memoize: bool
+    memoize_maxsize: int
+    memoize_ttl: float
+    depends: type or tuple
+
     def __init__(self, **kwargs) -> None: ...
 
     def __call__(self) -> str: ...
 
+    @classmethod
+    def evaluate_many(cls, **columns) -> list: ...
+
+    @classmethod
+    def cache_info(cls) -> tuple: ...
+
+    @classmethod
+    def cache_clear(cls) -> None: ...
+
     @classmethod
     def buildtoJSON(cls) -> str: ...
     
@@ -37,4 +88,73 @@ class Integrated_Graphical(object):
 
     def __getitem__(self, key: str) -> int or float: ...
 
-def loadfromJSON(json: str) -> type: ...
\ No newline at end of file
+    def evaluate_all(self) -> dict: ...
+
+    def as_dict(self) -> dict: ...
+
+    @classmethod
+    def evaluate_table(cls, columns) -> dict: ...
+
+def loadfromJSON(json: str) -> type: ...
+
+def loadfromJSONLines(source, onerror=None, encoding: str = "utf-8"): ...
+
+def buildAlltoJSON(file, formulas=None, indent: int = None) -> int: ...
+
+class Graphical_library(object):
+
+    def __init__(self, path: str, encoding: str = "utf-8") -> None: ...
+
+    def __getitem__(self, key: str) -> type: ...
+
+    def get(self, key: str, default=None) -> type: ...
+
+    def __contains__(self, key: str) -> bool: ...
+
+    def __len__(self) -> int: ...
+
+    def keys(self): ...
+
+    def names(self): ...
+
+    def loaded(self) -> dict: ...
+
+def buildtoBundle(kinds, file) -> int: ...
+
+def loadfromBundle(path: str) -> Graphical_bundle: ...
+
+class Graphical_bundle(object):
+
+    def __init__(self, path: str) -> None: ...
+
+    def __getitem__(self, key) -> type: ...
+
+    def get(self, key, default=None) -> type: ...
+
+    def __contains__(self, key) -> bool: ...
+
+    def __len__(self) -> int: ...
+
+    def names(self): ...
+
+    def close(self) -> None: ...
+
+def evaluate_parallel(jobs, max_workers: int = None, chunk_size: int = 256, return_exceptions: bool = False) -> list: ...
+
+async def evaluate_async(jobs, executor=None, chunk_size: int = 256, max_concurrency: int = 4, return_exceptions: bool = False) -> list: ...
+
+def evaluate_stream(jobs, executor=None, chunk_size: int = 256, max_concurrency: int = 4, return_exceptions: bool = False): ...
+
+class Graphical_server(object):
+
+    def __init__(self, address: tuple = ("127.0.0.1", 8000), workers: int = 4, library: Graphical_library = None, verbose: bool = False, queue_size: int = None) -> None: ...
+
+    def serve_forever(self) -> None: ...
+
+    def shutdown(self) -> None: ...
+
+    def metrics(self) -> dict: ...
+
+def serve(host: str = "127.0.0.1", port: int = 8000, workers: int = 4, library: Graphical_library = None) -> None: ...
+
+def batch(source, output=None, format: str = None, workers: int = 1, library: str = None, chunk_size: int = 1024) -> int: ...